@@ -1,114 +1,862 @@
 #!/usr/bin/env python3
+import filecmp
+import gzip
+import hashlib
+import heapq
+import importlib
+import json
 import os
 import re
+import shutil
+import struct
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from itertools import islice
+from html import escape, unescape
 from pathlib import Path
+from urllib.parse import quote, unquote, urljoin
 
-# Try to load environment variables from .env file if dotenv is available
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    # dotenv not available, use environment variables or defaults
-    pass
+# Optional packages, and modules only some commands need, are imported on first use so that
+# importing this file to render entries stays cheap. Without brotli only gzip copies are
+# precompressed; without Pillow (PIL) images are copied as they are, with no smaller variants.
+@lru_cache(maxsize=None)
+def optional_module(name):
+    """Import module name on first use; None when it is not installed"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
 
-def simple_markdown_to_html(text):
-    """Simple markdown to HTML converter without external dependencies"""
-    html = text
-    
-    # Convert headers
-    html = re.sub(r'^### (.+)$', r'<h3>\1</h3>', html, flags=re.MULTILINE)
-    html = re.sub(r'^## (.+)$', r'<h3>\1</h3>', html, flags=re.MULTILINE)
-    html = re.sub(r'^# (.+)$', r'<h3>\1</h3>', html, flags=re.MULTILINE)
+def load_dotenv_file():
+    """Load environment variables from a .env file if python-dotenv is available"""
+    dotenv = optional_module('dotenv')
+    if dotenv is None:
+        # dotenv not available, use environment variables or defaults
+        return False
+    dotenv.load_dotenv()
+    return True
+
+def has_pillow():
+    return optional_module('PIL.Image') is not None
+
+# Block token kinds produced by tokenize_markdown()
+PARAGRAPH = 'paragraph'
+HEADING = 'heading'
+QUOTE = 'quote'
+LIST_OPEN = 'list_open'
+LIST_ITEM = 'list_item'
+LIST_CLOSE = 'list_close'
+CODE_OPEN = 'code_open'
+CODE_LINE = 'code_line'
+CODE_CLOSE = 'code_close'
+HTML = 'html'
+RAW_HTML = 'raw_html'
+
+# Fences and raw HTML are structural and handled by the tokenizer itself
+_FENCE_OPEN = re.compile(r'```\w*$')
+_FENCE_CLOSE = re.compile(r'```\s*$')
+# Raw HTML lines that open one of these keep following lines verbatim until it closes
+_RAW_BLOCK_OPEN = re.compile(r'<(pre|ul)[\s>]')
+
+# name: rule name (block rules: the token kind it produces)
+# pattern: compiled regex; render: called with the pattern's groups, returns HTML
+# trigger: characters an inline match can start with, '' if unknown
+InlineRule = namedtuple('InlineRule', 'name pattern render trigger')
+BlockRule = namedtuple('BlockRule', 'name pattern render')
+
+def _strong(text):
+    return f'<strong>{render_inline(text)}</strong>'
+
+def _em(text):
+    return f'<em>{render_inline(text)}</em>'
+
+# ![alt](path); ImagePipeline fills in the size and the copied file's URL after rendering
+IMAGE_PATTERN = r'!\[([^\]]*)\]\(([^)\s]+)\)'
+
+def _image(alt, src):
+    return f'<img src="{escape(src)}" alt="{escape(alt)}" loading="lazy" decoding="async">'
+
+# Inline markup in priority order: at the same position, earlier rules win
+INLINE_RULES = [
+    InlineRule('image', re.compile(IMAGE_PATTERN), _image, '!'),
+    InlineRule('code', re.compile(r'`(.+?)`'), lambda code: f'<code>{code}</code>', '`'),
+    InlineRule('strong', re.compile(r'\*\*(.+?)\*\*'), _strong, '*'),
+    InlineRule('strong_underscore', re.compile(r'__(.+?)__'), _strong, '_'),
+    InlineRule('em', re.compile(r'\*((?:\*\*.+?\*\*|[^*])+?)\*(?!\*)'), _em, '*'),
+    InlineRule('em_underscore', re.compile(r'_((?:__.+?__|[^_])+?)_(?!_)'), _em, '_'),
+]
+
+# Single-line blocks, tried in order on each line outside code and raw HTML
+BLOCK_RULES = [
+    BlockRule(HEADING, re.compile(r'#{1,3} (.+)$'), lambda text: f'<h3>{render_inline(text)}</h3>'),
+    BlockRule(QUOTE, re.compile(r'> (.+)$'), lambda text: f'<blockquote>{render_inline(text)}</blockquote>'),
+    BlockRule(LIST_ITEM, re.compile(r'(?:-|[0-9]+\.) (.+)$'), lambda text: f'<li>{render_inline(text)}</li>'),
+]
+
+def _combine(rules):
+    """Join rule patterns into one alternation; returns (pattern, slots by group)"""
+    alternatives = []
+    slots = {}
+    group = 1
+    for rule in rules:
+        alternatives.append(f'({rule.pattern.pattern})')
+        # The wrapping group closes last, so match.lastindex identifies the rule
+        slots[group] = (rule, group, group + rule.pattern.groups)
+        group += rule.pattern.groups + 1
+    return re.compile('|'.join(alternatives)), slots
+
+def compile_rules():
+    """Combine each rule table into a single precompiled scanner
     
-    # Convert bold
-    html = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html)
-    html = re.sub(r'__(.+?)__', r'<strong>\1</strong>', html)
+    Runs at import; call it again after editing either table by hand.
+    """
+    global _INLINE, _INLINE_SLOTS, _INLINE_TRIGGER, _BLOCK, _BLOCK_SLOTS, _BLOCK_RENDERERS
+    _INLINE, _INLINE_SLOTS = _combine(INLINE_RULES)
+    triggers = [rule.trigger for rule in INLINE_RULES]
+    # Lines without any trigger character skip the scan entirely
+    _INLINE_TRIGGER = re.compile('[' + re.escape(''.join(triggers)) + ']') if all(triggers) else None
+    _BLOCK, _BLOCK_SLOTS = _combine(BLOCK_RULES)
+    _BLOCK_RENDERERS = {rule.name: rule.render for rule in BLOCK_RULES}
+
+def _insert_rule(rules, rule, before):
+    names = [existing.name for existing in rules]
+    rules.insert(names.index(before) if before in names else len(rules), rule)
+    compile_rules()
+
+def add_inline_rule(name, pattern, render, trigger='', before=None):
+    """Register custom inline syntax, ahead of the rule named before if given
     
-    # Convert italic
-    html = re.sub(r'\*(.+?)\*', r'<em>\1</em>', html)
-    html = re.sub(r'_(.+?)_', r'<em>\1</em>', html)
+    pattern may use plain groups but not named groups or backreferences,
+    since it is combined with the other rules into one regex. render gets
+    the groups and returns HTML. Register rules at import time so that
+    process pool workers see them too.
+    """
+    _insert_rule(INLINE_RULES, InlineRule(name, re.compile(pattern), render, trigger), before)
+
+def add_block_rule(name, pattern, render, before=None):
+    """Register a custom single-line block, ahead of the rule named before if given"""
+    _insert_rule(BLOCK_RULES, BlockRule(name, re.compile(pattern), render), before)
+
+def _code_fingerprint(code):
+    # Bytecode alone misses constants, such as the tag a render lambda returns
+    consts = [_code_fingerprint(const) if hasattr(const, 'co_code') else repr(const) for const in code.co_consts]
+    return f'{code.co_code.hex()}\0{code.co_names}\0{consts}'
+
+def _render_fingerprint(render):
+    """Describe a render callable by its code, constants, defaults and closure values"""
+    code = getattr(render, '__code__', None)
+    if code is None:
+        return repr(render)
+    values = list(render.__defaults__ or ()) + sorted((render.__kwdefaults__ or {}).items())
+    values += [cell.cell_contents for cell in render.__closure__ or ()]
+    return _code_fingerprint(code) + '\0' + '\0'.join(
+        _render_fingerprint(value) if callable(value) else repr(value) for value in values)
+
+def rules_fingerprint():
+    """Describe the rule tables so the render cache notices custom rules"""
+    parts = []
+    for rule in INLINE_RULES + BLOCK_RULES:
+        parts.append(f'{rule.name}\0{rule.pattern.pattern}\0{_render_fingerprint(rule.render)}')
+    return '\n'.join(parts)
+
+def _inline_replacement(match):
+    rule, first, end = _INLINE_SLOTS[match.lastindex]
+    return rule.render(*match.groups()[first:end])
+
+def render_inline(text):
+    """Convert inline markup with every INLINE_RULES pattern in one left-to-right scan"""
+    if _INLINE_TRIGGER is not None and not _INLINE_TRIGGER.search(text):
+        return text
+    return _INLINE.sub(_inline_replacement, text)
+
+compile_rules()
+
+def tokenize_markdown(lines):
+    """Split markdown source lines into block tokens in one pass
     
-    # Convert code blocks
-    html = re.sub(r'```[\w]*\n(.*?)\n```', r'<pre><code>\1</code></pre>', html, flags=re.DOTALL)
+    Yields (kind, value) tuples; for BLOCK_RULES matches the value is the
+    match groups. Only paragraphs are buffered; code blocks and lists are
+    emitted a line at a time.
+    """
+    paragraph = []
+    in_list = False
+    in_code = False
+    raw_close = None
     
-    # Convert inline code
-    html = re.sub(r'`(.+?)`', r'<code>\1</code>', html)
+    for line in lines:
+        if in_code:
+            if _FENCE_CLOSE.match(line):
+                in_code = False
+                yield CODE_CLOSE, None
+            else:
+                yield CODE_LINE, line
+            continue
+        
+        if raw_close is not None:
+            if raw_close in line:
+                raw_close = None
+            yield RAW_HTML, line
+            continue
+        
+        stripped = line.strip()
+        if not stripped:
+            kind = None
+        elif line[0] == '<':
+            kind = HTML
+        elif line.startswith('```') and _FENCE_OPEN.match(line):
+            kind = CODE_OPEN
+        else:
+            # One match against all BLOCK_RULES at once
+            match = _BLOCK.match(line)
+            if match:
+                rule, first, end = _BLOCK_SLOTS[match.lastindex]
+                kind = rule.name
+                groups = match.groups()[first:end]
+            else:
+                kind = PARAGRAPH
+        
+        if in_list and kind != LIST_ITEM:
+            in_list = False
+            yield LIST_CLOSE, False
+        
+        if kind == PARAGRAPH:
+            paragraph.append(stripped)
+            continue
+        if paragraph:
+            yield PARAGRAPH, paragraph
+            paragraph = []
+        
+        if kind == LIST_ITEM:
+            if not in_list:
+                in_list = True
+                yield LIST_OPEN, None
+            yield LIST_ITEM, groups
+        elif kind == CODE_OPEN:
+            in_code = True
+            yield CODE_OPEN, None
+        elif kind == HTML:
+            raw = _RAW_BLOCK_OPEN.search(line)
+            if raw and f'</{raw.group(1)}>' not in line[raw.end():]:
+                # The block's lines, this one included, are passed through verbatim
+                raw_close = f'</{raw.group(1)}>'
+                yield RAW_HTML, line
+            else:
+                yield HTML, line
+        elif kind is not None:
+            yield kind, groups
     
-    # Convert blockquotes
-    html = re.sub(r'^> (.+)$', r'<blockquote>\1</blockquote>', html, flags=re.MULTILINE)
+    if paragraph:
+        yield PARAGRAPH, paragraph
+    if in_list:
+        # True marks a list that ends the text without a trailing newline
+        yield LIST_CLOSE, True
+    if in_code:
+        yield CODE_CLOSE, None
+
+def render_markdown_tokens(tokens):
+    """Render block tokens to HTML lines; joined with newlines they form the body"""
+    pending = None
+    for kind, value in tokens:
+        if kind == PARAGRAPH:
+            # Join lines without spaces for Japanese text
+            yield '<p>' + ''.join(render_inline(line) for line in value) + '</p>'
+        elif kind == HTML:
+            # A single line of HTML still gets its inline markup, as in <span>**太字**</span>
+            yield render_inline(value)
+        elif kind == RAW_HTML:
+            yield value
+        elif kind == LIST_OPEN:
+            yield '<ul>'
+        elif kind == LIST_ITEM:
+            if pending is not None:
+                yield pending
+            pending = _BLOCK_RENDERERS[LIST_ITEM](*value)
+        elif kind == LIST_CLOSE:
+            if value:
+                yield pending + '</ul>'
+            else:
+                yield pending
+                yield '</ul>'
+            pending = None
+        elif kind == CODE_OPEN:
+            pending = '<pre><code>'
+            first_line = True
+        elif kind == CODE_LINE:
+            if first_line:
+                pending += value
+                first_line = False
+            else:
+                yield pending
+                pending = value
+        elif kind == CODE_CLOSE:
+            yield pending + '</code></pre>'
+            pending = None
+        else:
+            # Single-line blocks from BLOCK_RULES
+            yield _BLOCK_RENDERERS[kind](*value)
+
+def markdown_to_html(text):
+    """Convert markdown text to HTML with the single-pass block tokenizer"""
+    return '\n'.join(render_markdown_tokens(tokenize_markdown(text.split('\n'))))
+
+def simple_markdown_to_html(text):
+    """Simple markdown to HTML converter without external dependencies
     
-    # Convert lists
-    html = re.sub(r'^- (.+)$', r'<li>\1</li>', html, flags=re.MULTILINE)
-    html = re.sub(r'^[0-9]+\. (.+)$', r'<li>\1</li>', html, flags=re.MULTILINE)
+    Kept for compatibility; see markdown_to_html().
+    """
+    return markdown_to_html(text)
+
+# Front matter is a block of "key: value" lines between two --- lines at the top of an entry
+FRONT_MATTER_FENCE = '---'
+# The header scanner gives up after this many lines, so a long entry is never read through
+FRONT_MATTER_MAX_LINES = 30
+_FRONT_MATTER_KEY = re.compile(r'(\w+)\s*:\s*(.*)$')
+_FRONT_MATTER_ITEM = re.compile(r'\s*-\s+(.*)$')
+_FRONT_MATTER_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+
+def _front_matter_length(lines):
+    """Number of lines the front matter at the start of lines takes, including both fences; 0 if none"""
+    if not lines or lines[0].rstrip() != FRONT_MATTER_FENCE:
+        return 0
+    for i, line in enumerate(lines[1:FRONT_MATTER_MAX_LINES + 2], 1):
+        if line.rstrip() == FRONT_MATTER_FENCE:
+            return i + 1
+        # Anything but keys, list items and blank lines means the --- was an ordinary line
+        if line.strip() and not _FRONT_MATTER_KEY.match(line) and not _FRONT_MATTER_ITEM.match(line):
+            return 0
+    return 0
+
+def skip_front_matter(lines):
+    """Yield lines without their leading front matter; lines may be any iterator of lines"""
+    lines = iter(lines)
+    head = []
+    for line in lines:
+        head.append(line)
+        if len(head) > FRONT_MATTER_MAX_LINES + 1 or (len(head) > 1 and line.rstrip() == FRONT_MATTER_FENCE):
+            break
+        if head[0].rstrip() != FRONT_MATTER_FENCE:
+            break
+    yield from head[_front_matter_length(head):]
+    yield from lines
+
+def _front_matter_value(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    if value.startswith('[') and value.endswith(']'):
+        return [_front_matter_value(item) for item in value[1:-1].split(',') if item.strip()]
+    return value
+
+def parse_front_matter(lines):
+    """Parse front matter lines, without the fences, into a dict
     
-    # Wrap consecutive list items in ul tags
-    html = re.sub(r'(<li>.*?</li>\n?)+', lambda m: '<ul>\n' + m.group(0) + '</ul>\n', html, flags=re.DOTALL)
+    Only the subset of YAML entries need is understood: "key: value",
+    quoted strings, [a, b] lists and lists of "- item" lines under an
+    empty key.
+    """
+    meta = {}
+    key = None
+    for line in lines:
+        item = _FRONT_MATTER_ITEM.match(line)
+        if item and key is not None:
+            if not isinstance(meta[key], list):
+                meta[key] = []
+            meta[key].append(_front_matter_value(item.group(1)))
+            continue
+        match = _FRONT_MATTER_KEY.match(line)
+        if match:
+            key = match.group(1).lower()
+            meta[key] = _front_matter_value(match.group(2))
+    return meta
+
+def read_front_matter(md_file):
+    """Read only the front matter of md_file, never its body; returns a dict, empty if there is none"""
+    with open(md_file, encoding='utf-8') as f:
+        head = []
+        for line in f:
+            head.append(line.rstrip('\r\n'))
+            if len(head) > FRONT_MATTER_MAX_LINES + 1 or (len(head) > 1 and head[-1].rstrip() == FRONT_MATTER_FENCE):
+                break
+            if head[0].rstrip() != FRONT_MATTER_FENCE:
+                break
+    length = _front_matter_length(head)
+    return parse_front_matter(head[1:length - 1]) if length else {}
+
+# title: shown in place of the file name; date: 'YYYY-MM-DD' or None; tags: list of str; draft: bool
+EntryMeta = namedtuple('EntryMeta', 'title date tags draft')
+
+def entry_meta(stem, front_matter):
+    """EntryMeta from parsed front matter, falling back to the file name for the title and date"""
+    title = str(front_matter.get('title') or stem)
+    date = None
+    match = _FRONT_MATTER_DATE.match(str(front_matter.get('date', '')))
+    if match:
+        date = '-'.join(match.groups())
+    elif len(stem) == 8 and stem.isdigit():
+        # Entries named like 20250720.md are dated by their name
+        date = f'{stem[:4]}-{stem[4:6]}-{stem[6:]}'
+    tags = front_matter.get('tags', [])
+    if isinstance(tags, str):
+        tags = [tag.strip() for tag in tags.split(',')]
+    tags = [str(tag) for tag in tags if str(tag).strip()]
+    draft = str(front_matter.get('draft', '')).lower() in ('true', 'yes', 'on', '1')
+    return EntryMeta(title, date, tags, draft)
+
+def entry_title(md_file, metas=None):
+    """Title of an entry: its front matter title when metas has one, else the file name"""
+    meta = metas.get(md_file.stem) if metas else None
+    return meta.title if meta is not None else md_file.stem
+
+def entry_to_html(text):
+    """Convert the markdown of an entry, leaving out its front matter"""
+    if not text.startswith(FRONT_MATTER_FENCE):
+        return markdown_to_html(text)
+    return '\n'.join(render_markdown_tokens(tokenize_markdown(skip_front_matter(text.split('\n')))))
+
+# Entries at least this large are converted line by line instead of as one string
+STREAM_MIN_BYTES = 1024 * 1024
+# Output lines are batched into chunks of about this many characters
+STREAM_CHUNK_CHARS = 64 * 1024
+
+def iter_markdown_lines(f):
+    """Yield the lines of a text file without newlines, exactly as text.split('\\n') would"""
+    line = ''
+    for line in f:
+        yield line[:-1] if line.endswith('\n') else line
+    # split() gives a last, empty item after a trailing newline or for an empty text
+    if not line or line.endswith('\n'):
+        yield ''
+
+def stream_markdown_to_html(lines):
+    """Yield the markdown_to_html() output for lines in chunks that end at line breaks
     
-    # Convert paragraphs - handle single line breaks properly for Japanese text
-    paragraphs = []
-    current_para = []
-    in_pre = False
-    in_list = False
+    Only the current block, paragraph or list item, is held in memory, so
+    a multi-megabyte entry costs as much as its largest block.
+    """
+    batch = []
+    size = 0
+    started = False
+    for line in render_markdown_tokens(tokenize_markdown(lines)):
+        if started:
+            batch.append('\n')
+            if size >= STREAM_CHUNK_CHARS:
+                yield ''.join(batch)
+                batch = []
+                size = 0
+        batch.append(line)
+        size += len(line) + 1
+        started = True
+    if batch:
+        yield ''.join(batch)
+
+class StreamedBody:
+    """HTML body of a large entry, produced in chunks each time it is iterated
     
-    for line in html.split('\n'):
-        if '<pre>' in line:
-            in_pre = True
-        if '</pre>' in line:
-            in_pre = False
-        if '<ul>' in line:
-            in_list = True
-        if '</ul>' in line:
-            in_list = False
-            
-        if line.strip() == '' and not in_pre and not in_list:
-            if current_para:
-                # Join lines without spaces for Japanese text
-                paragraphs.append('<p>' + ''.join(current_para) + '</p>')
-                current_para = []
-        elif not line.startswith('<') or in_pre:
-            if not in_pre and not in_list:
-                current_para.append(line.strip())
-            else:
-                paragraphs.append(line)
+    Chunks come from the cached fragment when there is one, otherwise from
+    converting md_file again. Every chunk ends at a line break, so no tag
+    is split between two of them, and transform, if given, can rewrite
+    each chunk on its own.
+    """
+
+    def __init__(self, md_file, fragment=None, transform=None):
+        self.md_file = md_file
+        self.fragment = fragment
+        self.transform = transform
+
+    def __iter__(self):
+        chunks = self._chunks()
+        return chunks if self.transform is None else map(self.transform, chunks)
+
+    def _chunks(self):
+        if self.fragment is not None:
+            with open(self.fragment, encoding='utf-8', newline='') as f:
+                while True:
+                    lines = f.readlines(STREAM_CHUNK_CHARS)
+                    if not lines:
+                        break
+                    yield ''.join(lines)
         else:
-            if current_para:
-                # Join lines without spaces for Japanese text
-                paragraphs.append('<p>' + ''.join(current_para) + '</p>')
-                current_para = []
-            paragraphs.append(line)
+            with open(self.md_file, encoding='utf-8') as f:
+                yield from stream_markdown_to_html(skip_front_matter(iter_markdown_lines(f)))
+
+def body_chunks(html_body):
+    """Iterate an entry body that is either a string or a StreamedBody"""
+    return (html_body,) if isinstance(html_body, str) else html_body
+
+# Bump when the layout of the render cache on disk changes
+RENDER_CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = '.nikki-cache'
+
+def decode_markdown(data):
+    """Decode raw file bytes the same way Path.read_text() would"""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+def renderer_fingerprint():
+    """Identify the converter and templates so stale cached fragments get dropped"""
+    digest = hashlib.sha256(f'render-cache-v{RENDER_CACHE_VERSION}\n'.encode('utf-8'))
+    # The converter and the page templates both live in this file
+    digest.update(Path(__file__).read_bytes())
+    digest.update(rules_fingerprint().encode('utf-8'))
+    return digest.hexdigest()
+
+def fragment_path(fragments_dir, sha):
+    return Path(fragments_dir) / sha[:2] / f'{sha}.html'
+
+def read_fragment(fragments_dir, sha):
+    """Return a cached fragment by content hash, or None if it is not cached"""
+    try:
+        with open(fragment_path(fragments_dir, sha), encoding='utf-8', newline='') as f:
+            return f.read()
+    except OSError:
+        return None
+
+# timings is (read wall, read cpu, convert wall, convert cpu) in seconds
+RenderResult = namedtuple('RenderResult', 'size mtime_ns sha256 html_body cached timings')
+
+def load_or_convert(md_file, fragments_dir=None):
+    """Read and hash md_file, converting it unless its fragment is already cached
     
-    if current_para:
-        # Join lines without spaces for Japanese text
-        paragraphs.append('<p>' + ''.join(current_para) + '</p>')
+    Returns a RenderResult. Kept at module level so process pool workers
+    can run it.
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    stat = os.stat(md_file)
+    if stat.st_size >= STREAM_MIN_BYTES:
+        return _load_or_convert_streamed(md_file, stat, fragments_dir, wall, cpu)
+    with open(md_file, 'rb') as f:
+        data = f.read()
+    sha = hashlib.sha256(data).hexdigest()
+    html_body = read_fragment(fragments_dir, sha) if fragments_dir is not None else None
+    read_wall, read_cpu = time.perf_counter(), time.process_time()
     
-    return '\n'.join(paragraphs)
+    cached = html_body is not None
+    if not cached:
+        html_body = entry_to_html(decode_markdown(data))
+    timings = (read_wall - wall, read_cpu - cpu,
+               time.perf_counter() - read_wall, time.process_time() - read_cpu)
+    return RenderResult(stat.st_size, stat.st_mtime_ns, sha, html_body, cached, timings)
 
-def generate_site(docs_dir='docs', output_file='index.html'):
-    docs_path = Path(docs_dir)
+def _load_or_convert_streamed(md_file, stat, fragments_dir, wall, cpu):
+    """load_or_convert() for a large entry, which is never held in memory whole
     
-    if not docs_path.exists():
-        print(f"Error: {docs_dir} directory not found")
-        return
+    The file is hashed in chunks, then on a miss converted line by line
+    straight into its fragment. The returned body is a StreamedBody.
+    """
+    digest = hashlib.sha256()
+    with open(md_file, 'rb') as f:
+        for block in iter(partial(f.read, OUTPUT_BUFFER_SIZE), b''):
+            digest.update(block)
+    sha = digest.hexdigest()
+    fragment = fragment_path(fragments_dir, sha) if fragments_dir is not None else None
+    cached = fragment is not None and fragment.exists()
+    read_wall, read_cpu = time.perf_counter(), time.process_time()
+    
+    if fragment is not None and not cached:
+        fragment.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fragment.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8', newline='') as out:
+            for chunk in StreamedBody(md_file):
+                out.write(chunk)
+        os.replace(tmp, fragment)
+    html_body = StreamedBody(md_file, fragment)
+    timings = (read_wall - wall, read_cpu - cpu,
+               time.perf_counter() - read_wall, time.process_time() - read_cpu)
+    return RenderResult(stat.st_size, stat.st_mtime_ns, sha, html_body, cached, timings)
+
+class RenderCache:
+    """Persistent cache of rendered entry bodies keyed by file path and content hash
+
+    index.json maps each markdown path to its size, mtime and sha256 so an
+    unchanged file is recognised from a stat() alone. Fragments are stored
+    by content hash, so a touched-but-identical file is still a hit.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.index_file = self.cache_dir / 'index.json'
+        self.fragments_dir = self.cache_dir / 'fragments'
+        self.fingerprint = renderer_fingerprint()
+        self.entries = {}
+        self.seen = {}
+        self.stats = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        data = load_json_store(self.index_file)
+        if not data:
+            return
+        if data.get('fingerprint') != self.fingerprint:
+            # Converter or template changed, every cached fragment is stale
+            shutil.rmtree(self.fragments_dir, ignore_errors=True)
+            return
+        self.entries = data.get('entries', {})
+
+    def _write_fragment(self, sha, html_body):
+        fragment = fragment_path(self.fragments_dir, sha)
+        fragment.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fragment.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8', newline='') as f:
+            f.write(html_body)
+        os.replace(tmp, fragment)
+
+    def prime(self, docs_path, snapshot):
+        """Take (size, mtime_ns) from a snapshot_docs() pass so lookup() needs no stat()"""
+        for name, stat in snapshot.items():
+            self.stats[(docs_path / name).as_posix()] = stat
+
+    def lookup(self, md_file):
+        """Return the cached body if md_file's size and mtime are unchanged, else None"""
+        key = md_file.as_posix()
+        stat = self.stats.pop(key, None)
+        if stat is None:
+            stat = md_file.stat()
+            stat = (stat.st_size, stat.st_mtime_ns)
+        record = self.entries.get(key)
+        if record and record['size'] == stat[0] and record['mtime_ns'] == stat[1]:
+            if record['size'] >= STREAM_MIN_BYTES:
+                fragment = fragment_path(self.fragments_dir, record['sha256'])
+                html_body = StreamedBody(md_file, fragment) if fragment.exists() else None
+            else:
+                html_body = read_fragment(self.fragments_dir, record['sha256'])
+            if html_body is not None:
+                self.seen[key] = record
+                self.hits += 1
+                return html_body
+        return None
+
+    def record(self, md_file, result):
+        """Remember a load_or_convert() result, storing the fragment if it is new"""
+        self.seen[md_file.as_posix()] = {'size': result.size, 'mtime_ns': result.mtime_ns,
+                                         'sha256': result.sha256}
+        if result.cached:
+            self.hits += 1
+        else:
+            # Large entries were already converted straight into their fragment
+            if isinstance(result.html_body, str):
+                self._write_fragment(result.sha256, result.html_body)
+            self.misses += 1
+
+    def render(self, md_file):
+        """Return the HTML body of md_file, converting it only on a cache miss
+        
+        Large entries come back as a StreamedBody rather than a string.
+        """
+        html_body = self.lookup(md_file)
+        if html_body is None:
+            result = load_or_convert(md_file, self.fragments_dir)
+            self.record(md_file, result)
+            html_body = result.html_body
+        return html_body
+
+    def save(self):
+        """Write the index for this build and drop fragments no entry uses any more"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        live = {record['sha256'] for record in self.seen.values()}
+        for record in self.entries.values():
+            if record['sha256'] not in live:
+                try:
+                    fragment_path(self.fragments_dir, record['sha256']).unlink()
+                except FileNotFoundError:
+                    pass
+        
+        save_json_store(self.index_file, {'fingerprint': self.fingerprint, 'entries': self.seen})
+        self.entries = dict(self.seen)
+
+class BuildProfiler:
+    """Per-phase wall and CPU time plus per-file conversion times for --profile
     
-    md_files = sorted([f for f in docs_path.glob('*.md')])
+    Phases nest, and each one is charged only the time not spent in phases
+    opened inside it, so the totals add up to the build time. "render" is
+    what is left of fetching bodies after read and convert: cache lookups,
+    or waiting on pool workers, whose read and convert time is summed.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.files = []
+        self.parallel = False
+        self.total = 0.0
+        self._start = None
+        self._stack = []
+
+    def begin(self):
+        self._start = time.perf_counter()
+
+    def end(self):
+        self.total += time.perf_counter() - self._start
+
+    def _charge(self, name, wall, cpu):
+        totals = self.phases.setdefault(name, [0.0, 0.0])
+        totals[0] += wall
+        totals[1] += cpu
+
+    def _nest(self, wall, cpu):
+        if self._stack:
+            self._stack[-1][2] += wall
+            self._stack[-1][3] += cpu
+
+    @contextmanager
+    def phase(self, name):
+        """Charge the time spent in the with block to phase name"""
+        frame = [time.perf_counter(), time.process_time(), 0.0, 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            wall = time.perf_counter() - frame[0]
+            cpu = time.process_time() - frame[1]
+            self._charge(name, wall - frame[2], cpu - frame[3])
+            self._nest(wall, cpu)
+
+    def iterate(self, name, iterable):
+        """Yield from iterable, charging the time spent producing each item to name"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_file(self, md_file, result, in_process=True):
+        """Account for one load_or_convert() result"""
+        read_wall, read_cpu, convert_wall, convert_cpu = result.timings
+        self._charge('read', read_wall, read_cpu)
+        self._charge('convert', convert_wall, convert_cpu)
+        if in_process:
+            self._nest(read_wall + convert_wall, read_cpu + convert_cpu)
+        else:
+            self.parallel = True
+        if not result.cached:
+            self.files.append((convert_wall, md_file.as_posix()))
+
+    def report(self, top=10):
+        """Return the collected timings as a JSON-serialisable dict"""
+        phases = {name: {'wall': wall, 'cpu': cpu} for name, (wall, cpu) in self.phases.items()}
+        if not self.parallel:
+            accounted = sum(wall for wall, _ in self.phases.values())
+            phases['other'] = {'wall': max(0.0, self.total - accounted), 'cpu': None}
+        return {
+            'total': self.total,
+            'parallel': self.parallel,
+            'phases': phases,
+            'converted_files': len(self.files),
+            'slowest_files': [{'path': path, 'seconds': seconds}
+                              for seconds, path in heapq.nlargest(top, self.files)],
+        }
+
+    def print_report(self, top=10, stream=sys.stderr):
+        report = self.report(top)
+        print(f"Build profile: {report['total'] * 1000:.1f} ms total", file=stream)
+        for name, times in report['phases'].items():
+            cpu = f"{times['cpu'] * 1000:10.1f} ms cpu" if times['cpu'] is not None else ''
+            print(f"  {name:<10}{times['wall'] * 1000:10.1f} ms wall{cpu}", file=stream)
+        if report['parallel']:
+            print("  (read and convert are summed over worker processes)", file=stream)
+        if report['slowest_files']:
+            print(f"Slowest of {report['converted_files']} converted files:", file=stream)
+            for item in report['slowest_files']:
+                print(f"  {item['seconds'] * 1000:8.2f} ms  {item['path']}", file=stream)
+
+def render_entry(md_file, cache=None):
+    """Convert one markdown file to its HTML body, reusing cache when given"""
+    if cache is not None:
+        return cache.render(md_file)
+    return entry_to_html(md_file.read_text(encoding='utf-8'))
+
+# Below this many entries a process pool costs more to start than it saves
+PARALLEL_MIN_FILES = 1000
+# Files handed to a worker per task; large enough to amortise pickling
+PARALLEL_CHUNK_SIZE = 64
+
+def _convert_chunk(paths, fragments_dir):
+    return [load_or_convert(path, fragments_dir) for path in paths]
+
+def iter_rendered_entries(md_files, cache=None, jobs=1, profiler=None):
+    """Yield (md_file, html_body) in the order of md_files
     
-    if not md_files:
-        print(f"No markdown files found in {docs_dir}")
+    With jobs > 1 and enough files, cache misses are read and converted in
+    a process pool a chunk at a time. Only a few chunks are in flight at
+    once, so memory stays bounded however large the archive is.
+    """
+    fragments_dir = cache.fragments_dir if cache is not None else None
+    if jobs <= 1 or len(md_files) < PARALLEL_MIN_FILES:
+        for md_file in md_files:
+            html_body = cache.lookup(md_file) if cache is not None else None
+            if html_body is None:
+                result = load_or_convert(md_file, fragments_dir)
+                if cache is not None:
+                    cache.record(md_file, result)
+                if profiler is not None:
+                    profiler.record_file(md_file, result)
+                html_body = result.html_body
+            yield md_file, html_body
         return
     
-    # Get environment variables
-    workspace = os.getenv("COUNTER_WORKSPACE", "nikkisite2025")
-    access_counter = os.getenv("ACCESS_COUNTER", "totalvisits")
-    like_counter = os.getenv("LIKE_COUNTER", "totallikes")
+    from concurrent.futures import ProcessPoolExecutor
+    chunks = (md_files[i:i + PARALLEL_CHUNK_SIZE] for i in range(0, len(md_files), PARALLEL_CHUNK_SIZE))
+    in_flight = deque()
     
-    html_content = '''<!DOCTYPE html>
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        def submit(chunk):
+            # Cache hits are answered here; only misses go to the pool
+            cached = {}
+            misses = []
+            for md_file in chunk:
+                html_body = cache.lookup(md_file) if cache is not None else None
+                if html_body is None:
+                    misses.append(md_file)
+                else:
+                    cached[md_file] = html_body
+            future = pool.submit(_convert_chunk, misses, fragments_dir) if misses else None
+            in_flight.append((chunk, cached, future))
+        
+        for chunk in chunks:
+            submit(chunk)
+            if len(in_flight) < jobs * 2:
+                continue
+            yield from _drain_chunk(in_flight.popleft(), cache, profiler)
+        while in_flight:
+            yield from _drain_chunk(in_flight.popleft(), cache, profiler)
+
+def _drain_chunk(item, cache, profiler):
+    chunk, cached, future = item
+    results = iter(future.result()) if future is not None else iter(())
+    for md_file in chunk:
+        if md_file in cached:
+            yield md_file, cached[md_file]
+            continue
+        result = next(results)
+        if cache is not None:
+            cache.record(md_file, result)
+        if profiler is not None:
+            profiler.record_file(md_file, result, in_process=False)
+        yield md_file, result.html_body
+
+SITE_TITLE = 'Nikki'
+
+# Page templates below fill their {{slots}} through Template; ${...} is left to the JavaScript
+
+# Document start up to the title
+PAGE_HEAD_START = '''<!DOCTYPE html>
 <html lang="ja">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Nikki</title>
-    <style>
-        body {
+    <title>{{title}}</title>
+'''
+
+PAGE_STYLE = '''        body {
             margin: 0;
             padding: 0;
             background-color: #f5f5f5;
@@ -249,6 +997,19 @@ def generate_site(docs_dir='docs', output_file='index.html'):
             background-color: #666;
         }
         
+        .scrubber {
+            width: min(480px, 60vw);
+            direction: rtl;
+            cursor: pointer;
+        }
+        
+        .scrubber-position {
+            color: #666;
+            font-size: 12px;
+            font-family: 'Hiragino Kaku Gothic ProN', 'Yu Gothic', sans-serif;
+            white-space: nowrap;
+        }
+        
         /* アクセスカウンター */
         .access-counter {
             position: fixed;
@@ -376,12 +1137,20 @@ def generate_site(docs_dir='docs', output_file='index.html'):
             0%, 100% { transform: scale(1); }
             50% { transform: scale(1.1); }
         }
-    </style>
-    <script>
-        window.addEventListener('load', function() {
+'''
+
+# Counter settings are substituted into the script only, never into entry bodies
+PAGE_SCRIPT = '''        window.addEventListener('load', function() {
             const container = document.querySelector('.container');
             const dots = document.querySelectorAll('.dot');
-            const contents = document.querySelectorAll('.content');
+            const scrubber = document.querySelector('.scrubber');
+            const scrubberPosition = document.querySelector('.scrubber-position');
+            // Articles from right to left, so index 0 is the rightmost one like dot 0
+            const articles = Array.from(document.querySelectorAll('.content')).reverse();
+            const dotByIndex = [];
+            dots.forEach((dot) => {
+                dotByIndex[parseInt(dot.getAttribute('data-index'))] = dot;
+            });
             
             if (container) {
                 // Scroll to the rightmost position
@@ -391,40 +1160,75 @@ def generate_site(docs_dir='docs', output_file='index.html'):
                 });
             }
             
-            // Function to update active dot based on scroll position
-            function updateActiveDot() {
-                const scrollLeft = container.scrollLeft;
-                const containerWidth = container.clientWidth;
-                const scrollWidth = container.scrollWidth;
-                
-                // Calculate which article is currently most visible
-                let currentArticleIndex = 0;
-                let accumulatedWidth = 0;
-                
-                // Find which article the current scroll position corresponds to
-                for (let i = 0; i < contents.length; i++) {
-                    const articleWidth = contents[i].offsetWidth + 60; // include margin
-                    const articleStartPos = scrollWidth - containerWidth - accumulatedWidth - articleWidth;
-                    const articleEndPos = scrollWidth - containerWidth - accumulatedWidth;
-                    
-                    if (scrollLeft >= articleStartPos && scrollLeft <= articleEndPos) {
-                        currentArticleIndex = i;
-                        break;
-                    }
-                    
-                    accumulatedWidth += articleWidth;
+            // Left and right edges of each article in scroll coordinates, measured once
+            // and again only after a resize, so scrolling never forces layout
+            let lefts = [];
+            let rights = [];
+            let offsetsValid = false;
+            
+            function measureArticles() {
+                const origin = container.getBoundingClientRect().left - container.scrollLeft;
+                lefts = new Array(articles.length);
+                rights = new Array(articles.length);
+                for (let i = 0; i < articles.length; i++) {
+                    const rect = articles[i].getBoundingClientRect();
+                    lefts[i] = rect.left - origin;
+                    rights[i] = rect.right - origin;
                 }
-                
-                // Update dot active state
-                dots.forEach((dot) => {
-                    const dotIndex = parseInt(dot.getAttribute('data-index'));
-                    const targetArticleIndex = dotIndex === 0 ? 0 : dotIndex - 1;
-                    
-                    if (targetArticleIndex === currentArticleIndex) {
-                        dot.classList.add('active');
+                offsetsValid = true;
+            }
+            
+            // Index of the article at the right edge of the view, where reading starts;
+            // lefts decrease with the index, so this is a binary search
+            function currentArticleIndex() {
+                if (!offsetsValid) {
+                    measureArticles();
+                }
+                const edge = container.scrollLeft + container.clientWidth - 1;
+                let low = 0;
+                let high = articles.length - 1;
+                while (low < high) {
+                    const mid = (low + high) >> 1;
+                    if (lefts[mid] <= edge) {
+                        high = mid;
                     } else {
-                        dot.classList.remove('active');
+                        low = mid + 1;
                     }
+                }
+                return low;
+            }
+            
+            // Only the previously active dot and the new one are touched
+            let activeIndex = -1;
+            function updateActiveDot() {
+                if (!articles.length) {
+                    return;
+                }
+                const index = currentArticleIndex();
+                if (index === activeIndex) {
+                    return;
+                }
+                if (dotByIndex[activeIndex]) {
+                    dotByIndex[activeIndex].classList.remove('active');
+                }
+                if (dotByIndex[index]) {
+                    dotByIndex[index].classList.add('active');
+                }
+                if (scrubber) {
+                    scrubber.value = index;
+                    scrubberPosition.textContent = (index + 1) + ' / ' + articles.length;
+                }
+                activeIndex = index;
+            }
+            
+            // Scroll so the right edge of an article meets the right edge of the view
+            function scrollToArticle(index, behavior) {
+                if (!offsetsValid) {
+                    measureArticles();
+                }
+                container.scrollTo({
+                    left: rights[index] - container.clientWidth,
+                    behavior: behavior
                 });
             }
             
@@ -441,12 +1245,32 @@ def generate_site(docs_dir='docs', output_file='index.html'):
                 }
             }
             
-            // Add scroll event listener
-            if (container) {
-                container.addEventListener('scroll', () => {
+            // Handle scroll events at most once per frame
+            let frame = 0;
+            function onScroll() {
+                if (frame) {
+                    return;
+                }
+                frame = requestAnimationFrame(() => {
+                    frame = 0;
                     updateActiveDot();
                     checkLikeButtonVisibility();
                 });
+            }
+            
+            // Article widths change on resize and when lazy bodies arrive
+            function invalidateOffsets() {
+                offsetsValid = false;
+                onScroll();
+            }
+            
+            if (container) {
+                container.addEventListener('scroll', onScroll, { passive: true });
+                window.addEventListener('resize', invalidateOffsets);
+                if (window.ResizeObserver) {
+                    const observer = new ResizeObserver(invalidateOffsets);
+                    articles.forEach((article) => observer.observe(article));
+                }
                 // Initial call after page load
                 setTimeout(() => {
                     updateActiveDot();
@@ -457,41 +1281,33 @@ def generate_site(docs_dir='docs', output_file='index.html'):
             // Add click handlers to dots
             dots.forEach((dot) => {
                 dot.addEventListener('click', () => {
-                    const dotIndex = parseInt(dot.getAttribute('data-index'));
-                    
-                    // Articles are in DOM from right to left (reversed order)
-                    // Dots are now: rightmost dot = data-index 0, leftmost dot = data-index 2
-                    // We want each dot to jump to its corresponding article's right edge (beginning)
-                    
-                    let targetScroll = 0;
-                    
-                    // Jump to article at index (dotIndex - 1) to correct the offset
-                    const targetArticleIndex = dotIndex === 0 ? 0 : dotIndex - 1;
-                    
-                    if (targetArticleIndex === 0) {
-                        // Jump to article 0's right edge (container's right edge)
-                        targetScroll = container.scrollWidth - container.clientWidth;
-                    } else {
-                        // Calculate position to show right edge of target article
-                        // Sum widths of articles from right (index 0) up to but not including target
-                        for (let i = 0; i < targetArticleIndex; i++) {
-                            targetScroll += contents[i].offsetWidth + 60; // 60px margin
-                        }
-                        // Position to show right edge of target article
-                        targetScroll = container.scrollWidth - container.clientWidth - targetScroll;
-                    }
-                    
-                    container.scrollTo({
-                        left: targetScroll,
-                        behavior: 'smooth'
-                    });
+                    scrollToArticle(parseInt(dot.getAttribute('data-index')), 'smooth');
                 });
             });
             
+            // Long archives get a scrubber instead of one dot per article
+            if (scrubber) {
+                let target = null;
+                scrubber.addEventListener('input', () => {
+                    const pending = target !== null;
+                    target = parseInt(scrubber.value);
+                    if (!pending) {
+                        requestAnimationFrame(() => {
+                            scrollToArticle(target, 'auto');
+                            target = null;
+                        });
+                    }
+                });
+            }
+            
             // CounterAPI V2設定（公開カウンター）
-            const WORKSPACE = 'WORKSPACE_PLACEHOLDER';
-            const ACCESS_COUNTER = 'ACCESS_COUNTER_PLACEHOLDER';
-            const LIKE_COUNTER = 'LIKE_COUNTER_PLACEHOLDER';
+            const COUNTER_API = '{{counter_api}}';
+            const WORKSPACE = '{{workspace}}';
+            const ACCESS_COUNTER = '{{access_counter}}';
+            const LIKE_COUNTER = '{{like_counter}}';
+            // 取得した値をsessionStorageに残す時間と、連続したいいねをまとめる時間（ミリ秒）
+            const COUNTER_TTL = 60 * 1000;
+            const LIKE_DEBOUNCE = 800;
             
             // ゾロ目チェック
             function isZorome(num) {
@@ -500,27 +1316,69 @@ def generate_site(docs_dir='docs', output_file='index.html'):
                 return str.split('').every(digit => digit === str[0]);
             }
             
+            // カウンターAPIクライアント
+            // 同じURLへの同時のリクエストは1つにまとめ、取得した値はCOUNTER_TTLの間再利用する
+            const counterClient = {
+                inFlight: {},
+                
+                // 期限切れでも最後に取得した値を返す（なければnull）
+                peek(counter) {
+                    const entry = JSON.parse(sessionStorage.getItem('counter:' + counter) || 'null');
+                    return entry ? entry.value : null;
+                },
+                
+                fresh(counter) {
+                    const entry = JSON.parse(sessionStorage.getItem('counter:' + counter) || 'null');
+                    return entry && Date.now() - entry.time < COUNTER_TTL ? entry.value : null;
+                },
+                
+                remember(counter, value) {
+                    sessionStorage.setItem('counter:' + counter, JSON.stringify({ value: value, time: Date.now() }));
+                },
+                
+                request(counter, up) {
+                    const url = `${COUNTER_API}/${WORKSPACE}/${counter}` + (up ? '/up' : '');
+                    if (!this.inFlight[url]) {
+                        this.inFlight[url] = fetch(url).then(async (response) => {
+                            if (!response.ok) {
+                                throw new Error(response.status + ' ' + await response.text());
+                            }
+                            const data = await response.json();
+                            this.remember(counter, data.data.up_count);
+                            return data.data.up_count;
+                        }).finally(() => {
+                            delete this.inFlight[url];
+                        });
+                    }
+                    return this.inFlight[url];
+                },
+                
+                // 新しい値がキャッシュにあればリクエストしない
+                get(counter) {
+                    const value = this.fresh(counter);
+                    return value !== null ? Promise.resolve(value) : this.request(counter, false);
+                },
+                
+                up(counter) {
+                    return this.request(counter, true);
+                }
+            };
+            
+            function showAccessCount(count) {
+                document.getElementById('access-count').textContent = count.toLocaleString();
+            }
+            
             // アクセスカウンター（V2 API: カウントアップして値を取得）
             async function updateAccessCounter() {
                 try {
-                    // V2エンドポイント（公開カウンター、認証不要）
-                    const url = `https://api.counterapi.dev/v2/${WORKSPACE}/${ACCESS_COUNTER}/up`;
-                    const response = await fetch(url);
+                    const count = await counterClient.up(ACCESS_COUNTER);
+                    showAccessCount(count);
                     
-                    if (response.ok) {
-                        const data = await response.json();
-                        const count = data.data.up_count;
-                        document.getElementById('access-count').textContent = count.toLocaleString();
-                        
-                        if (isZorome(count)) {
-                            const kiribanEl = document.getElementById('access-kiriban');
-                            kiribanEl.textContent = 'キリ番！';
-                            kiribanEl.style.display = 'inline';
-                            setTimeout(() => { kiribanEl.style.display = 'none'; }, 5000);
-                        }
-                    } else {
-                        console.error('アクセスカウンターエラー:', response.status, await response.text());
-                        document.getElementById('access-count').textContent = '-';
+                    if (isZorome(count)) {
+                        const kiribanEl = document.getElementById('access-kiriban');
+                        kiribanEl.textContent = 'キリ番！';
+                        kiribanEl.style.display = 'inline';
+                        setTimeout(() => { kiribanEl.style.display = 'none'; }, 5000);
                     }
                 } catch (error) {
                     console.error('アクセスカウンターエラー:', error);
@@ -530,53 +1388,62 @@ def generate_site(docs_dir='docs', output_file='index.html'):
             
             // 現在のアクセス数表示（V2 API: カウントアップせずに値を取得）
             async function showCurrentAccessCount() {
+                const last = counterClient.peek(ACCESS_COUNTER);
+                if (last !== null) {
+                    showAccessCount(last);
+                }
                 try {
-                    const url = `https://api.counterapi.dev/v2/${WORKSPACE}/${ACCESS_COUNTER}`;
-                    const response = await fetch(url);
-                    
-                    if (response.ok) {
-                        const data = await response.json();
-                        const count = data.data.up_count;
-                        document.getElementById('access-count').textContent = count.toLocaleString();
-                    }
+                    showAccessCount(await counterClient.get(ACCESS_COUNTER));
                 } catch (error) {
                     console.error('アクセス数取得エラー:', error);
                 }
             }
             
             // いいねボタン処理（V2 API）
-            async function handleLikeButton() {
+            // 押した数を直前の数に足してすぐ表示し、LIKE_DEBOUNCEの間に続けて押された分をまとめて送る
+            // V2 APIは1回に1つしか増やせないので、押された回数だけ順にカウントアップする
+            let likeTimer = null;
+            let pendingLikes = 0;
+            function handleLikeButton() {
                 const button = document.getElementById('like-button');
                 const messageDiv = document.getElementById('like-message');
-                button.disabled = true;
+                const last = counterClient.peek(LIKE_COUNTER);
                 
+                pendingLikes++;
+                messageDiv.innerHTML = '<span class="thank-you">ありがとう！</span>' +
+                    (last !== null ? `<span class="like-count">${(last + pendingLikes).toLocaleString()}</span>` : '');
+                clearTimeout(likeTimer);
+                likeTimer = setTimeout(() => {
+                    const likes = pendingLikes;
+                    likeTimer = null;
+                    pendingLikes = 0;
+                    sendLike(button, messageDiv, likes);
+                }, LIKE_DEBOUNCE);
+            }
+            
+            async function sendLike(button, messageDiv, likes) {
+                button.disabled = true;
                 try {
-                    const url = `https://api.counterapi.dev/v2/${WORKSPACE}/${LIKE_COUNTER}/up`;
-                    const response = await fetch(url);
+                    // 同じURLへの同時のリクエストはまとめられてしまうため、1つずつ待って送る
+                    let count = null;
+                    for (let i = 0; i < likes; i++) {
+                        count = await counterClient.up(LIKE_COUNTER);
+                    }
                     
-                    if (response.ok) {
-                        const data = await response.json();
-                        const count = data.data.up_count;
-                        
-                        messageDiv.innerHTML = `
-                            <span class="thank-you">ありがとう！</span>
-                            <span class="like-count">${count.toLocaleString()}</span>
-                            ${isZorome(count) ? '<span class="zorome">ゾロ目だ！</span>' : ''}
-                        `;
-                        
-                        if (isZorome(count)) {
-                            createConfetti();
-                        }
-                        
-                        setTimeout(() => { 
-                            button.disabled = false;
-                            messageDiv.innerHTML = `<span class="like-count">${count.toLocaleString()}</span>`;
-                        }, 3000);
-                    } else {
-                        console.error('いいねエラー:', response.status, await response.text());
-                        messageDiv.innerHTML = '<span style="color: red;">エラー</span>';
-                        button.disabled = false;
+                    messageDiv.innerHTML = `
+                        <span class="thank-you">ありがとう！</span>
+                        <span class="like-count">${count.toLocaleString()}</span>
+                        ${isZorome(count) ? '<span class="zorome">ゾロ目だ！</span>' : ''}
+                    `;
+                    
+                    if (isZorome(count)) {
+                        createConfetti();
                     }
+                    
+                    setTimeout(() => { 
+                        button.disabled = false;
+                        messageDiv.innerHTML = `<span class="like-count">${count.toLocaleString()}</span>`;
+                    }, 3000);
                 } catch (error) {
                     console.error('いいねエラー:', error);
                     messageDiv.innerHTML = '<span style="color: red;">エラー</span>';
@@ -614,23 +1481,23 @@ def generate_site(docs_dir='docs', output_file='index.html'):
             
             // 現在のいいね数表示（V2 API）
             async function showCurrentLikeCount() {
+                const messageDiv = document.getElementById('like-message');
+                const last = counterClient.peek(LIKE_COUNTER);
+                if (last !== null) {
+                    messageDiv.innerHTML = `<span class="like-count">${last.toLocaleString()}</span>`;
+                }
                 try {
-                    const url = `https://api.counterapi.dev/v2/${WORKSPACE}/${LIKE_COUNTER}`;
-                    const response = await fetch(url);
-                    
-                    if (response.ok) {
-                        const data = await response.json();
-                        const count = data.data.up_count;
-                        document.getElementById('like-message').innerHTML = 
-                            `<span class="like-count">${count.toLocaleString()}</span>`;
-                    }
+                    const count = await counterClient.get(LIKE_COUNTER);
+                    messageDiv.innerHTML = `<span class="like-count">${count.toLocaleString()}</span>`;
                 } catch (error) {
                     console.error('いいね数取得エラー:', error);
-                    document.getElementById('like-message').innerHTML = '';
+                    if (last === null) {
+                        messageDiv.innerHTML = '';
+                    }
                 }
             }
             
-            // カウンター初期化
+            // カウンター初期化（両方のリクエストを同時に送る）
             if (!sessionStorage.getItem('counted')) {
                 updateAccessCounter();
                 sessionStorage.setItem('counted', 'true');
@@ -643,8 +1510,10 @@ def generate_site(docs_dir='docs', output_file='index.html'):
             // いいねボタンイベント
             document.getElementById('like-button').addEventListener('click', handleLikeButton);
         });
-    </script>
-</head>
+'''
+
+# Closes the head and opens the scroll container
+PAGE_BODY_START = '''</head>
 <body>
     <!-- アクセスカウンター（右上） -->
     <div id="access-counter" class="access-counter">
@@ -655,19 +1524,9 @@ def generate_site(docs_dir='docs', output_file='index.html'):
     
     <div class="container">
 '''
-    
-    # Reverse the order so 001 is rightmost
-    for md_file in reversed(md_files):
-        file_content = md_file.read_text(encoding='utf-8')
-        html_body = simple_markdown_to_html(file_content)
-        
-        html_content += f'''        <div class="content">
-            <h2>{md_file.stem}</h2>
-            {html_body}
-        </div>
-'''
-    
-    html_content += '''    </div>
+
+# Closes the scroll container and opens the progress dot strip
+PAGE_FOOTER = '''    </div>
     
     <!-- いいねボタン（下中央固定） -->
     <div class="like-section">
@@ -682,25 +1541,2413 @@ def generate_site(docs_dir='docs', output_file='index.html'):
     
     <div class="progress-dots">
 '''
-    
-    # Add dots for each article (reverse order so rightmost dot is index 0)
-    for i in range(len(md_files) - 1, -1, -1):
-        html_content += f'        <div class="dot" data-index="{i}"></div>\n'
-    
-    html_content += '''    </div>
-</body>
+
+# One article; body may be streamed in chunks
+ENTRY_TEMPLATE = '''        <div class="content"{{attrs}}>
+            <h2>{{title}}</h2>
+            {{body}}
+        </div>
+'''
+
+DOT_TEMPLATE = '''        <div class="dot" data-index="{{index}}"></div>
+'''
+
+# Above this many entries on a page the progress dots become a scrubber
+PROGRESS_DOTS_MAX = 40
+
+# Stands in for the dots; value 0 is at the right like dot 0
+SCRUBBER_TEMPLATE = '''        <input type="range" class="scrubber" min="0" max="{{max}}" value="0" aria-label="記事の位置">
+        <span class="scrubber-position">1 / {{count}}</span>
+'''
+
+# Closes the progress dot strip and the document
+PAGE_END = '''    </div>
+{{extra_body}}</body>
 </html>'''
+
+_TEMPLATE_SLOT = re.compile(r'\{\{(\w+)\}\}')
+
+class TemplateError(ValueError):
+    """A template uses a {{slot}} that no value is given for"""
+
+class Template:
+    """Template text compiled once into literal and {{slot}} segments
     
-    # Replace placeholders with actual values
-    html_content = html_content.replace('WORKSPACE_PLACEHOLDER', workspace)
-    html_content = html_content.replace('ACCESS_COUNTER_PLACEHOLDER', access_counter)
-    html_content = html_content.replace('LIKE_COUNTER_PLACEHOLDER', like_counter)
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+    segments alternates literal text (even indices) and slot names (odd
+    indices), so rendering is a single join.
+    """
+
+    def __init__(self, text, name='<string>'):
+        self.name = name
+        self.segments = _TEMPLATE_SLOT.split(text)
+        self.slots = frozenset(self.segments[1::2])
+
+    def _values(self, values):
+        try:
+            return [values[slot] for slot in self.segments[1::2]]
+        except KeyError as error:
+            raise TemplateError(f"template {self.name} has no value for {{{{{error.args[0]}}}}}") from None
+
+    def render(self, **values):
+        segments = list(self.segments)
+        segments[1::2] = self._values(values)
+        return ''.join(segments)
+
+    def write(self, out, **values):
+        """Write the template to out; a value may also be a StreamedBody, written chunk by chunk"""
+        filled = self._values(values)
+        if all(isinstance(value, str) for value in filled):
+            segments = list(self.segments)
+            segments[1::2] = filled
+            out.write(''.join(segments))
+            return
+        for i, literal in enumerate(self.segments[::2]):
+            if literal:
+                out.write(literal)
+            if i < len(filled):
+                for chunk in body_chunks(filled[i]):
+                    out.write(chunk)
+
+    def partial(self, **values):
+        """Return a template with some slots filled in and the others left open"""
+        segments = [self.segments[0]]
+        for slot, literal in zip(self.segments[1::2], self.segments[2::2]):
+            if slot in values:
+                segments[-1] += values[slot] + literal
+            else:
+                segments += [slot, literal]
+        template = Template('', self.name)
+        template.segments = segments
+        template.slots = frozenset(segments[1::2])
+        return template
+
+# Template name -> (file name in a --templates directory, built-in text)
+TEMPLATES = {
+    'page_start': ('page_start.html', PAGE_HEAD_START + '{{assets}}' + PAGE_BODY_START),
+    'style': ('style.css', PAGE_STYLE),
+    'script': ('script.js', PAGE_SCRIPT),
+    'entry': ('entry.html', ENTRY_TEMPLATE),
+    'footer': ('footer.html', PAGE_FOOTER),
+    'dot': ('dot.html', DOT_TEMPLATE),
+    'scrubber': ('scrubber.html', SCRUBBER_TEMPLATE),
+    'page_end': ('page_end.html', PAGE_END),
+}
+
+def load_templates(directory=None):
+    """Compile every template, taking those present in directory from their files
     
-    print(f"Static site generated: {output_file}")
-    print(f"Processed {len(md_files)} markdown files")
+    Raises TemplateError when a file uses a {{slot}} its built-in template
+    does not have, such as a misspelt one, before anything is written.
+    """
+    templates = {}
+    for name, (file_name, text) in TEMPLATES.items():
+        template = Template(text, file_name)
+        path = Path(directory) / file_name if directory is not None else None
+        if path is not None and path.exists():
+            custom = Template(path.read_text(encoding='utf-8'), str(path))
+            unknown = sorted(custom.slots - template.slots)
+            if unknown:
+                raise TemplateError(f"template {path} uses unknown placeholder {{{{{unknown[0]}}}}}")
+            template = custom
+        templates[name] = template
+    return templates
+
+def templates_fingerprint(templates):
+    """Hash of the compiled templates, for deciding whether pages built from them are stale"""
+    digest = hashlib.sha256()
+    for name in sorted(templates):
+        digest.update(json.dumps([name, templates[name].segments], ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+def write_default_templates(directory):
+    """Write the built-in templates to directory as a starting point for --templates"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for file_name, text in TEMPLATES.values():
+        with open(directory / file_name, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+
+# Compiled once; used whenever no templates are passed in
+DEFAULT_TEMPLATES = load_templates()
+
+# Extra styles and navigation for sharded output
+PAGER_STYLE = '''        
+        /* ページ送り */
+        .pager {
+            position: fixed;
+            top: 20px;
+            left: 20px;
+            display: flex;
+            gap: 15px;
+            align-items: center;
+            background: rgba(255, 255, 255, 0.95);
+            padding: 10px 20px;
+            border-radius: 25px;
+            box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
+            font-size: 14px;
+            z-index: 1000;
+            writing-mode: horizontal-tb;
+            font-family: 'Hiragino Kaku Gothic ProN', 'Yu Gothic', sans-serif;
+        }
+        
+        .pager a {
+            color: #667eea;
+            text-decoration: none;
+        }
+        
+        .pager-position {
+            color: #666;
+        }
+'''
+
+SHARD_NAME = 'page-{:04d}.html'
+
+# Entry-pages mode: one page per entry plus a list of titles, under ENTRY_DIR
+ENTRY_DIR = 'entries'
+ENTRY_INDEX_NAME = 'index.html'
+ENTRY_INDEX_TITLE = '目次'
+
+# Archives: month and tag lists of entries from their front matter, under ARCHIVE_DIR
+ARCHIVE_DIR = 'archive'
+ARCHIVE_INDEX_TITLE = 'アーカイブ'
+
+# Feeds: Atom and JSON Feed documents of the newest entries, next to the page
+FEED_ATOM_NAME = 'feed.xml'
+FEED_JSON_NAME = 'feed.json'
+# Entries in the feeds when --feed is given without a number
+FEED_ENTRIES = 20
+
+# Service worker: precaches the pages and assets, and checks everything else against content hashes
+SW_NAME = 'sw.js'
+PRECACHE_HASH_LENGTH = 16
+
+SW_REGISTER_SCRIPT = f'''        // オフライン用のService Worker
+        if ('serviceWorker' in navigator) {{
+            window.addEventListener('load', function() {{
+                navigator.serviceWorker.register(new URL('{SW_NAME}', SITE_ROOT).href);
+            }});
+        }}
+'''
+
+SW_SCRIPT = '''// Generated by generate_site.py; do not edit
+// Output path -> content hash. Files listed in CORE are fetched on install,
+// the others when first requested; a file is fetched again only when its hash changes.
+const MANIFEST = PRECACHE_MANIFEST_PLACEHOLDER;
+const CORE = PRECACHE_CORE_PLACEHOLDER;
+const CACHE = 'nikki-precache';
+const COUNTER_CACHE = 'nikki-counters';
+const COUNTER_API = 'COUNTER_API_PLACEHOLDER';
+const scope = new URL(self.registration.scope);
+
+function keyFor(path) {
+    return new URL(path + '?sw-hash=' + MANIFEST[path], scope).href;
+}
+
+async function fetchAndStore(cache, path) {
+    const response = await fetch(new URL(path, scope), { cache: 'no-cache' });
+    if (response.ok) {
+        await cache.put(keyFor(path), response.clone());
+    }
+    return response;
+}
+
+self.addEventListener('install', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        await Promise.all(CORE.map(async (path) => {
+            if (!(await cache.match(keyFor(path)))) {
+                await fetchAndStore(cache, path).catch(() => null);
+            }
+        }));
+        await self.skipWaiting();
+    })());
+});
+
+// Drop every copy whose hash is no longer in the manifest
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        const current = new Set(Object.keys(MANIFEST).map(keyFor));
+        for (const request of await cache.keys()) {
+            if (!current.has(request.url)) {
+                await cache.delete(request);
+            }
+        }
+        await self.clients.claim();
+    })());
+});
+
+// Counter reads answer with the last known value and refresh it in the background
+async function staleWhileRevalidate(event) {
+    const cache = await caches.open(COUNTER_CACHE);
+    const cached = await cache.match(event.request);
+    const network = fetch(event.request).then((response) => {
+        if (response.ok) {
+            cache.put(event.request, response.clone());
+        }
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(network.catch(() => null));
+        return cached;
+    }
+    return network;
+}
+
+self.addEventListener('fetch', (event) => {
+    if (event.request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(event.request.url);
+    if (event.request.url.startsWith(COUNTER_API + '/')) {
+        // Count-ups must always reach the server
+        if (!url.pathname.endsWith('/up')) {
+            event.respondWith(staleWhileRevalidate(event));
+        }
+        return;
+    }
+    if (url.origin !== scope.origin || !url.pathname.startsWith(scope.pathname)) {
+        return;
+    }
+    let path = url.pathname.slice(scope.pathname.length);
+    if (path === '' || path.endsWith('/')) {
+        path += 'index.html';
+    }
+    if (!(path in MANIFEST)) {
+        return;
+    }
+    event.respondWith((async () => {
+        const cache = await caches.open(CACHE);
+        const cached = await cache.match(keyFor(path));
+        if (cached) {
+            return cached;
+        }
+        try {
+            return await fetchAndStore(cache, path);
+        } catch (error) {
+            return fetch(event.request);
+        }
+    })());
+});
+'''
+
+# Search index: bigram posting lists sharded by the first character's code point
+SEARCH_DIR = 'search'
+SEARCH_SHARDS = 64
+SEARCH_INDEX_VERSION = 1
+SEARCH_MAX_RESULTS = 30
+
+SEARCH_STYLE = '''        
+        /* 全文検索 */
+        .search-box {
+            position: fixed;
+            top: 20px;
+            left: 50%;
+            transform: translateX(-50%);
+            width: min(320px, 60vw);
+            z-index: 1000;
+            writing-mode: horizontal-tb;
+            font-family: 'Hiragino Kaku Gothic ProN', 'Yu Gothic', sans-serif;
+        }
+        
+        .search-box input {
+            width: 100%;
+            box-sizing: border-box;
+            padding: 8px 16px;
+            border: none;
+            border-radius: 20px;
+            box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
+            font-size: 14px;
+        }
+        
+        .search-results {
+            list-style: none;
+            margin: 6px 0 0 0;
+            padding: 0;
+            max-height: 60vh;
+            overflow-y: auto;
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 10px;
+        }
+        
+        .search-results:empty {
+            display: none;
+        }
+        
+        .search-results li {
+            line-height: 1.5;
+            margin: 0;
+            padding: 6px 16px;
+            font-size: 14px;
+        }
+        
+        .search-results a {
+            color: #667eea;
+            text-decoration: none;
+        }
+'''
+
+# Defines SITE_ROOT for the scripts below; split assets live one directory down
+SITE_ROOT_SCRIPT = '''        // サイトのルート（外部スクリプトのときはその一つ上のディレクトリ）
+        const SITE_ROOT = document.currentScript && document.currentScript.src
+            ? new URL('../', document.currentScript.src) : new URL('./', document.baseURI);
+'''
+
+SEARCH_SCRIPT = '''        const SEARCH_BASE = new URL('SEARCH_DIR_PLACEHOLDER/', SITE_ROOT);
+        
+        window.addEventListener('load', function() {
+            const SHARDS = SEARCH_SHARDS_PLACEHOLDER;
+            const MAX_RESULTS = SEARCH_MAX_RESULTS_PLACEHOLDER;
+            const loaded = {};
+            
+            const box = document.createElement('div');
+            box.className = 'search-box';
+            box.innerHTML = '<input type="search" placeholder="検索" aria-label="日記を検索"><ul class="search-results"></ul>';
+            document.body.appendChild(box);
+            const input = box.querySelector('input');
+            const list = box.querySelector('.search-results');
+            
+            // 存在しない分割ファイルは空として扱い、通信エラーは次の検索で読み直す
+            function load(name) {
+                if (!loaded[name]) {
+                    loaded[name] = fetch(new URL(name, SEARCH_BASE))
+                        .then(response => response.ok ? response.json() : {})
+                        .catch(error => {
+                            delete loaded[name];
+                            throw error;
+                        });
+                }
+                return loaded[name];
+            }
+            
+            function shardName(gram) {
+                const code = gram.codePointAt(0) % SHARDS;
+                return (code < 16 ? '0' : '') + code.toString(16) + '.json';
+            }
+            
+            // 差分で保存された記事番号を戻す
+            function decode(deltas) {
+                const ids = [];
+                let id = 0;
+                for (const delta of deltas) {
+                    id += delta;
+                    ids.push(id);
+                }
+                return ids;
+            }
+            
+            // 2文字以上の語はその bi-gram すべて、1文字の語はその文字で始まる索引語のどれかを含む記事
+            async function postings(run) {
+                const chars = Array.from(run);
+                if (chars.length === 1) {
+                    const shard = await load(shardName(run));
+                    const ids = new Set();
+                    for (const gram in shard) {
+                        if (gram.startsWith(run)) {
+                            decode(shard[gram]).forEach(id => ids.add(id));
+                        }
+                    }
+                    return [ids];
+                }
+                const sets = [];
+                for (let i = 0; i + 1 < chars.length; i++) {
+                    const gram = chars[i] + chars[i + 1];
+                    const shard = await load(shardName(gram));
+                    sets.push(new Set(decode(shard[gram] || [])));
+                }
+                return sets;
+            }
+            
+            async function search(query) {
+                const runs = query.normalize('NFKC').toLowerCase().split(/\\s+/).filter(run => run);
+                if (!runs.length) {
+                    return [];
+                }
+                const [docs, ...groups] = await Promise.all([load('docs.json'), ...runs.map(postings)]);
+                let matches = null;
+                for (const set of groups.flat()) {
+                    matches = matches === null ? set : new Set([...matches].filter(id => set.has(id)));
+                }
+                // 新しい記事から表示する
+                return [...matches].sort((a, b) => b - a).slice(0, MAX_RESULTS).map(id => docs[id]).filter(doc => doc);
+            }
+            
+            let timer = null;
+            let latest = 0;
+            input.addEventListener('input', function() {
+                clearTimeout(timer);
+                timer = setTimeout(async function() {
+                    const request = ++latest;
+                    let results = [];
+                    try {
+                        results = await search(input.value);
+                    } catch (error) {
+                        console.warn('検索に失敗しました', error);
+                    }
+                    if (request !== latest) {
+                        return;
+                    }
+                    list.innerHTML = '';
+                    for (const [title, page] of results) {
+                        const item = document.createElement('li');
+                        const link = document.createElement('a');
+                        link.href = new URL(page, SITE_ROOT).href + '#' + encodeURIComponent(title);
+                        link.textContent = title;
+                        item.appendChild(link);
+                        list.appendChild(item);
+                    }
+                }, 150);
+            });
+            
+            // #タイトル の記事までスクロールする
+            function showHashEntry() {
+                const title = decodeURIComponent(location.hash.slice(1));
+                for (const heading of document.querySelectorAll('.content h2')) {
+                    if (heading.textContent === title) {
+                        heading.parentElement.scrollIntoView({ inline: 'center' });
+                        break;
+                    }
+                }
+            }
+            window.addEventListener('hashchange', showHashEntry);
+            if (location.hash) {
+                showHashEntry();
+            }
+        });
+'''.replace('SEARCH_DIR_PLACEHOLDER', SEARCH_DIR).replace(
+    'SEARCH_SHARDS_PLACEHOLDER', str(SEARCH_SHARDS)).replace('SEARCH_MAX_RESULTS_PLACEHOLDER', str(SEARCH_MAX_RESULTS))
+
+# Images entries reference are copied here under content-hashed names
+IMAGE_DIR = 'images'
+IMAGE_HASH_LENGTH = 16
+IMAGE_STORE_VERSION = 2
+# Widths of the downscaled copies made when Pillow is installed
+IMAGE_VARIANT_WIDTHS = (480, 960, 1600)
+IMAGE_VARIANT_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+# Files that make the page include IMAGE_STYLE when found under the docs directory
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg')
+# Largest share of the viewport an image takes; IMAGE_STYLE and the sizes attribute agree on it
+IMAGE_MAX_VW = 80
+IMAGE_MAX_VH = 60
+
+IMAGE_STYLE = f'''        
+        /* 記事中の画像 */
+        .content img {{
+            display: block;
+            max-width: {IMAGE_MAX_VW}vw;
+            max-height: {IMAGE_MAX_VH}vh;
+            width: auto;
+            height: auto;
+            margin: 0 1em;
+        }}
+'''
+
+# Split-assets mode: stylesheet and script are written here under content-hashed names
+ASSETS_DIR = 'assets'
+ASSET_HASH_LENGTH = 10
+ASSET_HEADERS = f'''/{ASSETS_DIR}/*
+  Cache-Control: public, max-age=31536000, immutable
+'''
+
+# Lazy mode: bodies live in CONTENT_DIR and are fetched as they near the viewport
+CONTENT_DIR = 'content'
+# Entries at the end the page opens on (the right) are still inlined
+LAZY_EAGER_ENTRIES = 3
+# Rough column size used to reserve space for a body before it loads
+LAZY_CHARS_PER_COLUMN = 40
+LAZY_COLUMN_WIDTH_EM = 2.2
+
+LAZY_SCRIPT = '''        window.addEventListener('load', function() {
+            const container = document.querySelector('.container');
+            const pending = document.querySelectorAll('.content[data-src]');
+            
+            // 本文を取得して差し込む
+            async function loadBody(el) {
+                const src = el.getAttribute('data-src');
+                el.removeAttribute('data-src');
+                try {
+                    const response = await fetch(src);
+                    if (!response.ok) {
+                        console.error('本文取得エラー:', response.status, src);
+                        return;
+                    }
+                    const html = await response.text();
+                    const before = el.offsetWidth;
+                    const leftOfView = el.offsetLeft + before <= container.scrollLeft + container.clientWidth / 2;
+                    el.insertAdjacentHTML('beforeend', html);
+                    el.style.minWidth = '';
+                    // 左側の記事が広がっても表示中の位置がずれないようにする
+                    if (leftOfView) {
+                        container.scrollLeft += el.offsetWidth - before;
+                    }
+                } catch (error) {
+                    console.error('本文取得エラー:', error);
+                }
+            }
+            
+            if (!('IntersectionObserver' in window)) {
+                pending.forEach(loadBody);
+                return;
+            }
+            
+            // 横スクロールで近づいた記事から読み込む
+            const observer = new IntersectionObserver((entries) => {
+                entries.forEach((entry) => {
+                    if (entry.isIntersecting) {
+                        observer.unobserve(entry.target);
+                        loadBody(entry.target);
+                    }
+                });
+            }, { root: container, rootMargin: '0px 150%' });
+            
+            pending.forEach((el) => observer.observe(el));
+        });
+'''
+
+# Large enough that each entry reaches the file in a handful of write calls
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+# Counter API V2 base URL; COUNTER_API_URL points the page at another host, such as tools/counter_stub.py
+DEFAULT_COUNTER_API = 'https://api.counterapi.dev/v2'
+
+def render_assets(workspace, access_counter, like_counter, extra_style='', extra_script='',
+                  counter_api=DEFAULT_COUNTER_API, templates=None):
+    """Return the page stylesheet and script with the counter settings filled in"""
+    templates = templates or DEFAULT_TEMPLATES
+    script = templates['script'].render(counter_api=counter_api.rstrip('/'), workspace=workspace,
+                                        access_counter=access_counter, like_counter=like_counter)
+    return templates['style'].render() + extra_style, script + extra_script
+
+def head_template(workspace, access_counter, like_counter, extra_style='', extra_script='', asset_urls=None,
+                  counter_api=DEFAULT_COUNTER_API, templates=None, extra_head=''):
+    """Return the page head as a template with only {{title}} left open
+    
+    With asset_urls (css, js) the assets are linked instead of inlined.
+    extra_head is markup such as feed links, placed before the assets.
+    """
+    templates = templates or DEFAULT_TEMPLATES
+    if asset_urls is not None:
+        css_url, js_url = asset_urls
+        assets = (f'    <link rel="stylesheet" href="{css_url}">\n'
+                  f'    <script src="{js_url}" defer></script>\n')
+    else:
+        style, script = render_assets(workspace, access_counter, like_counter, extra_style, extra_script,
+                                      counter_api, templates)
+        assets = ('    <style>\n' + style + '    </style>\n'
+                  '    <script>\n' + script + '    </script>\n')
+    return templates['page_start'].partial(assets=extra_head + assets)
+
+def render_head(workspace, access_counter, like_counter, extra_style='', extra_script='', asset_urls=None,
+                counter_api=DEFAULT_COUNTER_API, templates=None, title=SITE_TITLE, extra_head=''):
+    """Return the page head; with asset_urls (css, js) the assets are linked instead of inlined"""
+    return head_template(workspace, access_counter, like_counter, extra_style, extra_script, asset_urls,
+                         counter_api, templates, extra_head).render(title=title)
+
+def feed_links(prefix=''):
+    """<link> tags announcing the feeds to browsers and feed readers"""
+    return (f'    <link rel="alternate" type="application/atom+xml" title="{SITE_TITLE}" href="{prefix}{FEED_ATOM_NAME}">\n'
+            f'    <link rel="alternate" type="application/feed+json" title="{SITE_TITLE}" href="{prefix}{FEED_JSON_NAME}">\n')
+
+def write_if_changed(path, content):
+    """Write content to path unless the file already holds exactly that; returns True if written"""
+    path = Path(path)
+    try:
+        if path.read_text(encoding='utf-8') == content:
+            return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(content, encoding='utf-8')
+    os.replace(tmp, path)
+    return True
+
+def replace_if_changed(tmp, path):
+    """Move tmp over path unless path already holds the same bytes; returns True if replaced
+    
+    An unchanged output thus keeps its mtime, so hosts keep serving the
+    same ETag and precompressed copies stay current.
+    """
+    try:
+        same = filecmp.cmp(tmp, path, shallow=False)
+    except OSError:
+        same = False
+    if same:
+        os.unlink(tmp)
+        return False
+    os.replace(tmp, path)
+    return True
+
+def load_json_store(path, version=None):
+    """Read a JSON store kept in the cache directory
+    
+    Returns an empty dict when path is None, the file is missing or
+    unreadable, or version is given and the store records another one.
+    """
+    if path is None:
+        return {}
+    try:
+        data = json.loads(Path(path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or (version is not None and data.get('version') != version):
+        return {}
+    return data
+
+def save_json_store(path, data):
+    """Write a JSON store atomically, leaving the file untouched if it already holds data; None skips it"""
+    if path is not None:
+        write_if_changed(path, json.dumps(data, ensure_ascii=False, sort_keys=True))
+
+def write_assets(output_dir, style, script):
+    """Write the stylesheet and script under ASSETS_DIR named by content hash
+    
+    Returns their URLs relative to output_dir. A file whose hashed name
+    already exists is left untouched, and outdated versions are removed.
+    """
+    assets_dir = Path(output_dir) / ASSETS_DIR
+    assets_dir.mkdir(parents=True, exist_ok=True)
+    urls = []
+    current = set()
+    for content, suffix in ((style, '.css'), (script, '.js')):
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:ASSET_HASH_LENGTH]
+        name = f'site.{digest}{suffix}'
+        current.add(name)
+        if not (assets_dir / name).exists():
+            write_if_changed(assets_dir / name, content)
+        urls.append(f'{ASSETS_DIR}/{name}')
+    
+    for stale in assets_dir.glob('site.*'):
+        if stale.name not in current and stale.suffix in ('.css', '.js'):
+            remove_output(stale)
+    
+    # Hosts that read a _headers file (Netlify, Cloudflare Pages) cache hashed assets for good;
+    # GitHub Pages ignores it, and there only the hashed names keep stale assets out
+    write_if_changed(Path(output_dir) / '_headers', ASSET_HEADERS)
+    return tuple(urls)
+
+# Elements whose content is whitespace-sensitive or not HTML
+_MINIFY_PRESERVED = re.compile(r'(<pre\b.*?</pre>|<textarea\b.*?</textarea>'
+                               r'|<script\b[^>]*>.*?</script>|<style\b[^>]*>.*?</style>)', re.S)
+_MINIFY_COMMENT = re.compile(r'<!--.*?-->', re.S)
+_MINIFY_LINE_SPACE = re.compile(r'[ \t]*\n\s*')
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_CSS_SPACE = re.compile(r'\s+')
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*|(:)\s+')
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+def minify_css(css):
+    """Drop comments and the whitespace around CSS punctuation"""
+    css = _CSS_COMMENT.sub('', css)
+    css = _CSS_SPACE.sub(' ', css)
+    css = _CSS_PUNCTUATION.sub(lambda m: m.group(1) or m.group(2), css)
+    return css.replace(';}', '}').strip()
+
+def minify_js(js):
+    """Drop indentation, blank lines and whole-line comments from a script
+    
+    Line breaks are kept so automatic semicolon insertion still applies,
+    and lines inside multi-line template literals are left as they are.
+    """
+    lines = []
+    in_template = False
+    for line in js.split('\n'):
+        if in_template:
+            lines.append(line)
+        else:
+            line = line.lstrip()
+            if not line or line.startswith('//'):
+                continue
+            lines.append(line)
+        if (line.count('`') - line.count('\\`')) % 2:
+            in_template = not in_template
+        elif not in_template:
+            lines[-1] = lines[-1].rstrip()
+    return '\n'.join(lines)
+
+def minify_html(html, at_line_start=False):
+    """Drop comments, indentation and blank lines outside <pre>, and minify inline CSS and JS
+    
+    Every line break is kept as a single one, so text and inline elements
+    render exactly as before. at_line_start says html follows a line break.
+    """
+    parts = _MINIFY_PRESERVED.split(html)
+    for i, part in enumerate(parts):
+        if i % 2:
+            if part.startswith('<script'):
+                open_tag, _, rest = part.partition('>')
+                parts[i] = open_tag + '>' + minify_js(rest[:-len('</script>')]) + '</script>'
+            elif part.startswith('<style'):
+                open_tag, _, rest = part.partition('>')
+                parts[i] = open_tag + '>' + minify_css(rest[:-len('</style>')]) + '</style>'
+            continue
+        part = _MINIFY_LINE_SPACE.sub('\n', _MINIFY_COMMENT.sub('', part))
+        if i == 0 and at_line_start:
+            part = part.lstrip()
+        parts[i] = part
+    return ''.join(parts)
+
+_MINIFY_OPEN = re.compile(r'<(pre|textarea|script|style)\b')
+
+def _unclosed_element(text):
+    """Return the offset and closing tag of an element kept by minify_html() that text leaves open"""
+    pos = 0
+    while True:
+        match = _MINIFY_OPEN.search(text, pos)
+        if match is None:
+            return None, None
+        close = f'</{match.group(1)}>'
+        end = text.find(close, match.end())
+        if end < 0:
+            return match.start(), close
+        pos = end + len(close)
+
+class MinifyingWriter:
+    """File wrapper that minifies each write
+    
+    An element kept by minify_html() may span several writes, as in the
+    chunks of a StreamedBody; it is then passed through verbatim until it
+    closes. Writes must not split a tag.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.raw = 0
+        self.at_line_start = True
+        self.open_until = None
+
+    def write(self, text):
+        self.raw += len(text.encode('utf-8'))
+        if self.open_until is not None:
+            end = text.find(self.open_until)
+            if end < 0:
+                self._emit(text)
+                return
+            end += len(self.open_until)
+            self.open_until = None
+            self._emit(text[:end])
+            text = text[end:]
+        
+        start, close = _unclosed_element(text)
+        if start is not None:
+            self._emit(minify_html(text[:start], self.at_line_start))
+            self.open_until = close
+            self._emit(text[start:])
+        else:
+            self._emit(minify_html(text, self.at_line_start))
+
+    def _emit(self, text):
+        if text:
+            self.at_line_start = text.endswith('\n')
+            self.out.write(text)
+
+def remove_output(path):
+    """Delete an output file together with its precompressed copies"""
+    for name in [path.name] + [path.name + suffix for suffix in COMPRESSED_SUFFIXES]:
+        candidate = path.with_name(name)
+        if candidate.exists():
+            candidate.unlink()
+
+def precompress(path):
+    """Write path.gz (and path.br when brotli is available) unless they are up to date
+    
+    The gzip header carries no timestamp, so identical pages give identical
+    files. Returns the sizes of the compressed copies by suffix.
+    """
+    source_mtime = path.stat().st_mtime_ns
+    brotli = optional_module('brotli')
+    sizes = {}
+    for suffix in COMPRESSED_SUFFIXES:
+        target = path.with_name(path.name + suffix)
+        if suffix == '.br' and brotli is None:
+            if target.exists():
+                target.unlink()
+            continue
+        try:
+            if target.stat().st_mtime_ns >= source_mtime:
+                sizes[suffix] = target.stat().st_size
+                continue
+        except OSError:
+            pass
+        tmp = target.with_name(target.name + '.tmp')
+        if suffix == '.gz':
+            with open(path, 'rb') as src, open(tmp, 'wb') as raw:
+                with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as gz:
+                    shutil.copyfileobj(src, gz, OUTPUT_BUFFER_SIZE)
+        else:
+            tmp.write_bytes(brotli.compress(path.read_bytes(), quality=11))
+        os.replace(tmp, target)
+        sizes[suffix] = target.stat().st_size
+    return sizes
+
+class OutputProcessor:
+    """Minifies pages while they are written and precompresses them afterwards
+    
+    Every output goes through open(), track() or copy(), so finish() knows
+    which files to compress, or whose stale compressed copies to remove
+    when compression is off. open() and copy() write to a temporary file
+    that replaces the output only if its content differs, so a rebuild that
+    changes nothing leaves every output untouched. written counts the
+    outputs that were replaced.
+    """
+
+    def __init__(self, minify=False, compress=False):
+        self.minify = minify
+        self.compress = compress
+        # Output path -> size before minification, or None when not minified
+        self.files = {}
+        self.written = 0
+
+    @contextmanager
+    def open(self, path, buffering=-1):
+        path = Path(path)
+        tmp = path.with_name(path.name + '.tmp')
+        try:
+            with open(tmp, 'w', encoding='utf-8', buffering=buffering) as out:
+                writer = MinifyingWriter(out) if self.minify else out
+                yield writer
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.written += replace_if_changed(tmp, path)
+        self.files[path] = writer.raw if self.minify else None
+
+    def minify_assets(self, style, script):
+        if not self.minify:
+            return style, script
+        return minify_css(style), minify_js(script)
+
+    def track(self, path, raw=None):
+        self.files[Path(path)] = raw
+
+    def copy(self, src, dst):
+        tmp = Path(dst).with_name(Path(dst).name + '.tmp')
+        shutil.copyfile(src, tmp)
+        self.written += replace_if_changed(tmp, dst)
+        self.files[Path(dst)] = self.files.get(Path(src))
+
+    def finish(self):
+        """Compress or clean up every tracked file; returns (path, raw, size, compressed) rows"""
+        rows = []
+        for path, raw in self.files.items():
+            if self.compress:
+                compressed = precompress(path)
+            else:
+                compressed = {}
+                for suffix in COMPRESSED_SUFFIXES:
+                    stale = path.with_name(path.name + suffix)
+                    if stale.exists():
+                        stale.unlink()
+            rows.append((path, raw, path.stat().st_size, compressed))
+        return rows
+
+    def print_report(self, rows, output_dir, stream=sys.stdout):
+        """Print bytes saved per page and asset; content files and search shards are summed per directory"""
+        output_dir = Path(output_dir)
+        lines = {}
+        for path, raw, size, compressed in rows:
+            if path.parent.name in (CONTENT_DIR, SEARCH_DIR):
+                name = f'{path.parent.name}/*{path.suffix}'
+            else:
+                name = os.path.relpath(path, output_dir)
+            line = lines.setdefault(name, [0, 0, 0, {}])
+            line[0] += 1
+            line[1] += size if raw is None else raw
+            line[2] += size
+            for suffix, compressed_size in compressed.items():
+                line[3][suffix] = line[3].get(suffix, 0) + compressed_size
+        
+        print("Output sizes (bytes):", file=stream)
+        for name, (count, raw, size, compressed) in lines.items():
+            label = f'{name} ({count} files)' if count > 1 else name
+            parts = [f'{raw}']
+            if self.minify:
+                parts.append(f'minified {size} (-{raw - size})')
+            for suffix, compressed_size in sorted(compressed.items()):
+                parts.append(f'{suffix[1:]} {compressed_size} (-{raw - compressed_size})')
+            print(f"  {label}: " + ', '.join(parts), file=stream)
+
+def write_entry(out, title, html_body, attrs='', templates=None):
+    """Write one article block; a streamed body is written without building a copy"""
+    (templates or DEFAULT_TEMPLATES)['entry'].write(out, attrs=attrs, title=title, body=html_body)
+
+def write_lazy_body(content_dir, md_file, html_body, processor=None):
+    """Write an entry body to its own content file; return the placeholder attributes"""
+    if processor is None:
+        processor = OutputProcessor()
+    chars = 0
+    with processor.open(Path(content_dir) / f'{md_file.stem}.html') as f:
+        for chunk in body_chunks(html_body):
+            f.write(chunk)
+            chars += len(re.sub(r'<[^>]*>', '', chunk))
+    # Reserve roughly the width the body will take so loading it shifts little
+    width = max(1, -(-chars // LAZY_CHARS_PER_COLUMN)) * LAZY_COLUMN_WIDTH_EM
+    src = f'{CONTENT_DIR}/{quote(md_file.stem)}.html'
+    return f' data-src="{src}" style="min-width: {width:.1f}em"'
+
+def write_page(output_file, head, entries, extra_body='', content_dir=None, lazy_count=0, processor=None,
+               templates=None, metas=None):
+    """Stream one page of (md_file, html_body) entries to output_file
+    
+    Only one entry body is held in memory at a time. With content_dir set,
+    the first lazy_count entries get an empty placeholder and their body is
+    written to content_dir instead. Entries are titled from metas, stem ->
+    EntryMeta, when given. Returns the number of entries written.
+    """
+    if processor is None:
+        processor = OutputProcessor()
+    templates = templates or DEFAULT_TEMPLATES
+    entry = templates['entry']
+    count = 0
+    with processor.open(output_file, OUTPUT_BUFFER_SIZE) as out:
+        out.write(head)
+        for md_file, html_body in entries:
+            title = escape(entry_title(md_file, metas), quote=False)
+            if count < lazy_count:
+                attrs = write_lazy_body(content_dir, md_file, html_body, processor)
+                entry.write(out, attrs=attrs, title=title, body='')
+            else:
+                entry.write(out, attrs='', title=title, body=html_body)
+            count += 1
+        
+        out.write(templates['footer'].render())
+        
+        if count > PROGRESS_DOTS_MAX:
+            out.write(templates['scrubber'].render(max=str(count - 1), count=str(count)))
+        else:
+            # Add dots for each article (reverse order so rightmost dot is index 0)
+            dot = templates['dot']
+            out.write(''.join(dot.render(index=str(i)) for i in range(count - 1, -1, -1)))
+        
+        out.write(templates['page_end'].render(extra_body=extra_body))
+    return count
+
+def render_pager(number, total):
+    """Navigation between shards; newer pages sit to the left like newer entries"""
+    links = []
+    if number < total:
+        links.append(f'<a href="{SHARD_NAME.format(number + 1)}">← 新しい記事</a>')
+    links.append(f'<span class="pager-position">{number} / {total}</span>')
+    if number > 1:
+        links.append(f'<a href="{SHARD_NAME.format(number - 1)}">古い記事 →</a>')
+    return '    <nav class="pager">\n        ' + '\n        '.join(links) + '\n    </nav>\n'
+
+def lazy_count_for(entry_count, content_dir):
+    """Number of entries on a page whose bodies are deferred to content files"""
+    if content_dir is None:
+        return 0
+    return max(0, entry_count - LAZY_EAGER_ENTRIES)
+
+def shard_number(index, count, page_size):
+    """Number of the shard holding md_files[index] out of count entries"""
+    # The oldest shard takes the remainder, so the newest one is always full
+    return (index + -count % page_size) // page_size + 1
+
+def write_shards(output_file, head, md_files, page_size, cache, jobs, content_dir=None, profiler=None,
+                 processor=None, consumers=(), templates=None, metas=None):
+    """Write md_files as fixed-size page files plus an index showing the newest one
+    
+    Shards are numbered from the oldest entries. The oldest shard holds
+    the remainder, so the newest one, which the index copies, is always
+    full; adding entries moves the shard boundaries. All
+    entries are rendered newest first in one stream, so a single process
+    pool serves every shard, and the stream is cut at shard boundaries.
+    Each of consumers sees every entry through its tee() as it is written.
+    """
+    if profiler is None:
+        profiler = BuildProfiler()
+    if processor is None:
+        processor = OutputProcessor()
+    output_dir = Path(output_file).parent
+    total = (len(md_files) + page_size - 1) // page_size
+    offset = -len(md_files) % page_size
+    entries = profiler.iterate('render', iter_rendered_entries(md_files[::-1], cache, jobs, profiler))
+    for consumer in consumers:
+        entries = consumer.tee(entries)
+    for number in range(total, 0, -1):
+        shard_files = md_files[max(0, (number - 1) * page_size - offset):number * page_size - offset]
+        # Newest first, so the oldest entry of the shard is rightmost
+        shard_entries = islice(entries, len(shard_files))
+        with profiler.phase('write'):
+            write_page(output_dir / SHARD_NAME.format(number), head, shard_entries,
+                       render_pager(number, total),
+                       content_dir, lazy_count_for(len(shard_files), content_dir), processor, templates, metas)
+    
+    with profiler.phase('write'):
+        # The index is a copy of the newest shard, so readers land on it in one request
+        processor.copy(output_dir / SHARD_NAME.format(total), output_file)
+        
+        # Drop shards left over from a build with more pages
+        for stale in output_dir.glob('page-*.html'):
+            number = stale.stem[len('page-'):]
+            if number.isdigit() and int(number) > total:
+                remove_output(stale)
+    return total
+
+def prune_content_dir(content_dir, md_files):
+    """Remove content files whose entry no longer exists"""
+    stems = {md_file.stem for md_file in md_files}
+    for stale in Path(content_dir).glob('*.html'):
+        if stale.stem not in stems:
+            remove_output(stale)
+
+def entry_page_name(stem):
+    """File name of an entry's page under ENTRY_DIR, never ENTRY_INDEX_NAME
+    
+    An entry named index, or any name starting with '_', gets an extra
+    leading '_', so docs/index.md does not overwrite the title index and
+    no two entries share a page.
+    """
+    if stem == Path(ENTRY_INDEX_NAME).stem or stem.startswith('_'):
+        stem = '_' + stem
+    return f'{stem}.html'
+
+def render_entry_nav(newer, older, metas=None):
+    """Navigation for an entry page; the newer entry sits to the left as on the main page"""
+    links = []
+    if newer is not None:
+        links.append(f'<a href="{quote(entry_page_name(newer))}">← {escape(entry_title(Path(newer), metas), quote=False)}</a>')
+    links.append(f'<a href="{ENTRY_INDEX_NAME}">{ENTRY_INDEX_TITLE}</a>')
+    if older is not None:
+        links.append(f'<a href="{quote(entry_page_name(older))}">{escape(entry_title(Path(older), metas), quote=False)} →</a>')
+    return '    <nav class="pager">\n        ' + '\n        '.join(links) + '\n    </nav>\n'
+
+class EntryPages:
+    """Writes one page per entry under ENTRY_DIR and an index listing their titles
+    
+    Entries are taken from the main build with tee(), so no body is
+    rendered twice. head is a Template with a {{title}} slot. A page is
+    rewritten only when its key, a hash of the templates, its title, its
+    neighbours and its body, differs from the one recorded in manifest_file
+    by the previous build. Bodies are passed through images, an
+    ImagePipeline, so their images are linked from one directory down.
+    Titles come from metas, stem -> EntryMeta, when given.
+    """
+
+    def __init__(self, output_dir, md_files, head, manifest_file=None, processor=None, templates=None,
+                 images=None, metas=None):
+        self.entry_dir = Path(output_dir) / ENTRY_DIR
+        self.entry_dir.mkdir(parents=True, exist_ok=True)
+        self.head = head
+        self.templates = templates or DEFAULT_TEMPLATES
+        self.manifest_file = Path(manifest_file) if manifest_file is not None else None
+        self.processor = processor if processor is not None else OutputProcessor()
+        self.images = images
+        self.metas = metas
+        self.template = hashlib.sha256(json.dumps(
+            [head.segments, templates_fingerprint(self.templates), self.processor.minify], ensure_ascii=False
+        ).encode('utf-8')).hexdigest()
+        stems = [md_file.stem for md_file in md_files]
+        # Stem -> (newer, older) neighbour stems
+        self.neighbours = {stem: (stems[i + 1] if i + 1 < len(stems) else None, stems[i - 1] if i else None)
+                           for i, stem in enumerate(stems)}
+        self.previous = load_json_store(self.manifest_file).get('pages', {})
+        self.pages = {}
+        self.written = 0
+
+    def tee(self, entries):
+        """Yield entries unchanged, writing each one's page on the way"""
+        for md_file, html_body in entries:
+            self.write(md_file, html_body)
+            yield md_file, html_body
+
+    def _write_if_changed(self, name, key, md_file, html_body, nav):
+        self.pages[name] = key
+        path = self.entry_dir / name
+        if self.previous.get(name) == key and path.exists():
+            self.processor.track(path)
+            return
+        title = escape(entry_title(md_file, self.metas), quote=False)
+        head = self.head.render(title=f'{title} - {SITE_TITLE}')
+        write_page(path, head, [(md_file, html_body)], nav, processor=self.processor, templates=self.templates,
+                   metas=self.metas)
+        self.written += 1
+
+    def write(self, md_file, html_body):
+        newer, older = self.neighbours[md_file.stem]
+        if self.images is not None:
+            html_body = self.images.rewrite(html_body, '../')
+        nav = render_entry_nav(newer, older, self.metas)
+        title = entry_title(md_file, self.metas)
+        digest = hashlib.sha256('\0'.join([self.template, md_file.stem, title, nav, '']).encode('utf-8'))
+        for chunk in body_chunks(html_body):
+            digest.update(chunk.encode('utf-8'))
+        key = digest.hexdigest()
+        self._write_if_changed(entry_page_name(md_file.stem), key, md_file, html_body, nav)
+
+    def finish(self):
+        """Write the title index, remove pages of deleted entries and save the manifest"""
+        # Newest first, like the top of an archive list
+        stems = list(self.neighbours)[::-1]
+        titles = [escape(entry_title(Path(stem), self.metas), quote=False) for stem in stems]
+        items = ''.join(f'<li><a href="{quote(entry_page_name(stem))}">{title}</a></li>\n'
+                        for stem, title in zip(stems, titles))
+        body = f'<ul class="entry-index">\n{items}</ul>'
+        key = hashlib.sha256((self.template + body).encode('utf-8')).hexdigest()
+        self._write_if_changed(ENTRY_INDEX_NAME, key, Path(ENTRY_INDEX_TITLE), body, '')
+        
+        for stale in self.entry_dir.glob('*.html'):
+            if stale.name not in self.pages:
+                remove_output(stale)
+        
+        save_json_store(self.manifest_file, {'pages': self.pages})
+        return self.written, len(self.pages)
+
+def archive_tag_name(tag):
+    """File name of a tag's archive page; '/' would make a subdirectory"""
+    return f"tag-{tag.replace('/', '-')}.html"
+
+class ArchivePages:
+    """Writes month and tag archive pages under ARCHIVE_DIR from the entry index
+    
+    Pages are built from metas, stem -> EntryMeta, alone, so no entry body
+    is read. Entries link to the page holding them, page_for(i, md_file)
+    with i their position in md_files, and with anchors set to their
+    heading there, which the search script scrolls to. head is a Template
+    with a {{title}} slot for pages one directory down. Pages go through
+    processor, which leaves unchanged files untouched; pages of months and
+    tags that no longer have entries are removed.
+    """
+
+    def __init__(self, output_dir, md_files, metas, head, processor=None, templates=None, page_for=None,
+                 home='index.html', anchors=True):
+        self.archive_dir = Path(output_dir) / ARCHIVE_DIR
+        self.md_files = md_files
+        self.metas = metas
+        self.head = head
+        self.processor = processor if processor is not None else OutputProcessor()
+        self.templates = templates or DEFAULT_TEMPLATES
+        self.page_for = page_for or (lambda i, md_file: home)
+        self.home = home
+        self.anchors = anchors
+
+    def _items(self, positions):
+        items = []
+        # Newest first, like the entry index
+        for i in positions[::-1]:
+            md_file = self.md_files[i]
+            meta = self.metas[md_file.stem]
+            href = '../' + self.page_for(i, md_file)
+            if self.anchors:
+                href += '#' + quote(meta.title, safe='')
+            date = f'<time datetime="{meta.date}">{meta.date}</time> ' if meta.date else ''
+            items.append(f'<li>{date}<a href="{escape(href)}">{escape(meta.title, quote=False)}</a></li>\n')
+        return ''.join(items)
+
+    def _write(self, name, title, body):
+        nav = ('    <nav class="pager">\n'
+               f'        <a href="../{quote(self.home)}">{SITE_TITLE}</a>\n'
+               f'        <a href="index.html">{ARCHIVE_INDEX_TITLE}</a>\n'
+               '    </nav>\n')
+        stem = Path(name).stem
+        head = self.head.render(title=f'{escape(title, quote=False)} - {SITE_TITLE}')
+        write_page(self.archive_dir / name, head, [(Path(stem), body)], nav, processor=self.processor,
+                   templates=self.templates, metas={stem: EntryMeta(title, None, [], False)})
+
+    def write(self):
+        """Write every archive page and remove stale ones; returns (months, tags)"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        months = {}
+        tags = {}
+        for i, md_file in enumerate(self.md_files):
+            meta = self.metas[md_file.stem]
+            if meta.date:
+                months.setdefault(meta.date[:7], []).append(i)
+            for tag in meta.tags:
+                tags.setdefault(tag, []).append(i)
+        
+        names = {ENTRY_INDEX_NAME}
+        month_items = []
+        for month in sorted(months, reverse=True):
+            name = f'{month}.html'
+            year, number = month.split('-')
+            title = f'{year}年{int(number)}月'
+            self._write(name, title, f'<ul class="entry-index">\n{self._items(months[month])}</ul>')
+            month_items.append(f'<li><a href="{name}">{title}</a> ({len(months[month])})</li>\n')
+            names.add(name)
+        tag_items = []
+        for tag in sorted(tags):
+            name = archive_tag_name(tag)
+            self._write(name, f'タグ: {tag}', f'<ul class="entry-index">\n{self._items(tags[tag])}</ul>')
+            tag_items.append(f'<li><a href="{quote(name)}">{escape(tag, quote=False)}</a> ({len(tags[tag])})</li>\n')
+            names.add(name)
+        
+        body = f'<h3>月別</h3>\n<ul class="entry-index">\n{"".join(month_items)}</ul>\n'
+        if tag_items:
+            body += f'<h3>タグ</h3>\n<ul class="entry-index">\n{"".join(tag_items)}</ul>\n'
+        self._write(ENTRY_INDEX_NAME, ARCHIVE_INDEX_TITLE, body)
+        
+        for stale in self.archive_dir.glob('*.html'):
+            if stale.name not in names:
+                remove_output(stale)
+        return len(months), len(tags)
+
+_SEARCH_TAG = re.compile(r'<[^>]*>')
+_SEARCH_SPACE = re.compile(r'\s+')
+
+def search_grams(html_body):
+    """Index terms of an entry body: every character bigram of each whitespace-separated run
+    
+    The text is NFKC-normalised and lower-cased as the search page does
+    with queries. The last character of each run is added on its own, so
+    every character starts some term and one-character queries can be
+    answered from a single shard.
+    """
+    text = unicodedata.normalize('NFKC', unescape(_SEARCH_TAG.sub('', html_body))).lower()
+    grams = set()
+    for run in _SEARCH_SPACE.split(text):
+        if run:
+            grams.update(run[i:i + 2] for i in range(len(run) - 1))
+            grams.add(run[-1])
+    return grams
+
+def search_shard_name(gram):
+    return f'{ord(gram[0]) % SEARCH_SHARDS:02x}.json'
+
+class SearchIndex:
+    """Inverted index of entry bigrams written as SEARCH_DIR shards for the search box
+    
+    Entries are taken from the main build with tee(). The terms of every
+    entry are kept in store_file keyed by a hash of its body, so unchanged
+    entries are not tokenized again. Posting lists hold entry numbers in
+    md_files order, delta-encoded; shard files are rewritten only when
+    their content changes. Results are titled from metas, stem -> EntryMeta.
+    """
+
+    def __init__(self, output_dir, md_files, store_file=None, processor=None, page_for=None, metas=None):
+        self.output_dir = Path(output_dir)
+        self.search_dir = self.output_dir / SEARCH_DIR
+        self.md_files = md_files
+        self.store_file = Path(store_file) if store_file is not None else None
+        self.processor = processor if processor is not None else OutputProcessor()
+        self.page_for = page_for or (lambda i, md_file: 'index.html')
+        self.metas = metas
+        self.previous = load_json_store(self.store_file, SEARCH_INDEX_VERSION).get('entries', {})
+        self.entries = {}
+        self.tokenized = 0
+
+    def tee(self, entries):
+        """Yield entries unchanged, collecting each one's terms on the way"""
+        for md_file, html_body in entries:
+            self.add(md_file, html_body)
+            yield md_file, html_body
+
+    def add(self, md_file, html_body):
+        digest = hashlib.sha256()
+        for chunk in body_chunks(html_body):
+            digest.update(chunk.encode('utf-8'))
+        key = digest.hexdigest()
+        record = self.previous.get(md_file.stem)
+        if record is None or record[0] != key:
+            # Chunks end at line breaks, which also end a run of characters
+            grams = set()
+            for chunk in body_chunks(html_body):
+                grams.update(search_grams(chunk))
+            record = [key, sorted(grams)]
+            self.tokenized += 1
+        self.entries[md_file.stem] = record
+
+    def finish(self):
+        """Write the document list and every posting-list shard; returns (tokenized, shards written)"""
+        self.search_dir.mkdir(parents=True, exist_ok=True)
+        shards = {}
+        docs = []
+        for doc_id, md_file in enumerate(self.md_files):
+            docs.append([entry_title(md_file, self.metas), self.page_for(doc_id, md_file)])
+            for gram in self.entries[md_file.stem][1]:
+                shard = shards.setdefault(search_shard_name(gram), {})
+                shard.setdefault(gram, []).append(doc_id)
+        
+        names = {'docs.json'}
+        written = int(write_if_changed(self.search_dir / 'docs.json',
+                                       json.dumps(docs, ensure_ascii=False, separators=(',', ':'))))
+        self.processor.track(self.search_dir / 'docs.json')
+        for name, postings in shards.items():
+            # Ids were appended in increasing order, so deltas are small positive numbers
+            encoded = {gram: [ids[0]] + [b - a for a, b in zip(ids, ids[1:])] for gram, ids in postings.items()}
+            content = json.dumps(encoded, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+            written += write_if_changed(self.search_dir / name, content)
+            self.processor.track(self.search_dir / name)
+            names.add(name)
+        
+        for stale in self.search_dir.glob('*.json'):
+            if stale.name not in names:
+                remove_output(stale)
+        
+        save_json_store(self.store_file, {'version': SEARCH_INDEX_VERSION, 'entries': self.entries})
+        return self.tokenized, written
+
+def feed_timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+def feed_published(stem):
+    """Publication time of an entry named by its date, like 20250723; None for other names"""
+    if len(stem) != 8 or not stem.isdigit():
+        return None
+    try:
+        return time.strftime('%Y-%m-%dT00:00:00Z', time.strptime(stem, '%Y%m%d'))
+    except ValueError:
+        return None
+
+class Feeds:
+    """Atom and JSON Feed documents of the newest count entries
+    
+    Entries are taken from the main build with tee(), so bodies come from
+    the render cache rather than being converted again, and only the
+    newest count are kept. Each entry's updated time is its file's mtime,
+    but the time recorded in store_file is kept for as long as the body
+    hash is unchanged, so touching a file does not alter the feed, and it
+    is clamped to source_date_epoch (SOURCE_DATE_EPOCH) when given, so a
+    fresh checkout without the store builds the same feed. Ids are UUIDs
+    derived from id_base and the entry name, and both documents are
+    written only when their content changes, so their ETag stays the same
+    across builds that change nothing. Titles and publication dates come
+    from metas, stem -> EntryMeta, when given.
+    """
+
+    def __init__(self, output_dir, md_files, count=FEED_ENTRIES, store_file=None, processor=None, link_for=None,
+                 site_url='', id_base='', author=SITE_TITLE, source_date_epoch=None, metas=None):
+        self.output_dir = Path(output_dir)
+        self.md_files = md_files
+        self.newest = md_files[::-1][:count]
+        self.wanted = {md_file.stem for md_file in self.newest}
+        self.store_file = Path(store_file) if store_file is not None else None
+        self.processor = processor if processor is not None else OutputProcessor()
+        self.link_for = link_for or (lambda i, md_file: 'index.html')
+        self.site_url = site_url
+        self.id_base = id_base or site_url or SITE_TITLE
+        self.author = author
+        self.previous = load_json_store(self.store_file)
+        self.source_date_epoch = source_date_epoch
+        self.metas = metas
+        self.bodies = {}
+        self.updated = {}
+
+    def tee(self, entries):
+        """Yield entries unchanged, keeping the bodies of the newest ones on the way"""
+        for md_file, html_body in entries:
+            if md_file.stem in self.wanted:
+                self.add(md_file, html_body)
+            yield md_file, html_body
+
+    def add(self, md_file, html_body):
+        html_body = ''.join(body_chunks(html_body))
+        sha = hashlib.sha256(html_body.encode('utf-8')).hexdigest()
+        record = self.previous.get(md_file.stem)
+        if record is None or record[0] != sha:
+            record = [sha, feed_timestamp(md_file.stat().st_mtime)]
+        if self.source_date_epoch is not None:
+            # Stored times too, so a lower SOURCE_DATE_EPOCH takes effect; the format sorts as text
+            record = [sha, min(record[1], feed_timestamp(self.source_date_epoch))]
+        self.bodies[md_file.stem] = html_body
+        self.updated[md_file.stem] = record
+
+    def _id(self, name=''):
+        return f'urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, self.id_base + "/" + name)}'
+
+    def _url(self, path):
+        return urljoin(self.site_url, path) if self.site_url else path
+
+    def render_atom(self, items, updated):
+        base = f' xml:base="{escape(self.site_url)}"' if self.site_url else ''
+        lines = ['<?xml version="1.0" encoding="utf-8"?>',
+                 f'<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="ja"{base}>',
+                 f'  <id>{self._id()}</id>',
+                 f'  <title>{escape(SITE_TITLE)}</title>',
+                 f'  <updated>{updated}</updated>',
+                 f'  <author><name>{escape(self.author)}</name></author>',
+                 f'  <link rel="self" type="application/atom+xml" href="{escape(self._url(FEED_ATOM_NAME))}"/>',
+                 f'  <link rel="alternate" type="text/html" href="{escape(self._url("./"))}"/>']
+        for item in items:
+            lines += ['  <entry>',
+                      f'    <id>{item["id"]}</id>',
+                      f'    <title>{escape(item["title"])}</title>',
+                      f'    <updated>{item["date_modified"]}</updated>']
+            if 'date_published' in item:
+                lines.append(f'    <published>{item["date_published"]}</published>')
+            lines += [f'    <link rel="alternate" type="text/html" href="{escape(item["url"])}"/>',
+                      f'    <content type="html">{escape(item["content_html"], quote=False)}</content>',
+                      '  </entry>']
+        lines.append('</feed>')
+        return '\n'.join(lines) + '\n'
+
+    def render_json(self, items):
+        feed = {'version': 'https://jsonfeed.org/version/1.1', 'title': SITE_TITLE, 'language': 'ja',
+                'authors': [{'name': self.author}]}
+        if self.site_url:
+            feed['home_page_url'] = self.site_url
+            feed['feed_url'] = self._url(FEED_JSON_NAME)
+        feed['items'] = items
+        return json.dumps(feed, ensure_ascii=False, indent=1) + '\n'
+
+    def finish(self):
+        """Write both feeds if their content changed and save the store; returns the number of files written"""
+        positions = {md_file.stem: i for i, md_file in enumerate(self.md_files)}
+        items = []
+        for md_file in self.newest:
+            stem = md_file.stem
+            item = {'id': self._id(stem), 'url': self._url(self.link_for(positions[stem], md_file)),
+                    'title': entry_title(md_file, self.metas), 'content_html': self.bodies[stem],
+                    'date_modified': self.updated[stem][1]}
+            meta = self.metas.get(stem) if self.metas else None
+            published = feed_published(meta.date.replace('-', '') if meta is not None and meta.date else stem)
+            if published is not None:
+                item['date_published'] = published
+            items.append(item)
+        # The newest change, so the feed's own timestamp is as stable as its entries'
+        updated = max((item['date_modified'] for item in items), default=feed_timestamp(0))
+        
+        written = 0
+        for name, content in ((FEED_ATOM_NAME, self.render_atom(items, updated)),
+                              (FEED_JSON_NAME, self.render_json(items))):
+            written += write_if_changed(self.output_dir / name, content)
+            self.processor.track(self.output_dir / name)
+        
+        save_json_store(self.store_file, self.updated)
+        return written
+
+def _exif_orientation(exif):
+    """Orientation tag of a TIFF-format EXIF block, 1 when it has none"""
+    order = {b'II': '<', b'MM': '>'}.get(exif[:2])
+    if order is None or len(exif) < 8:
+        return 1
+    offset = struct.unpack(order + 'I', exif[4:8])[0]
+    if offset + 2 > len(exif):
+        return 1
+    count = struct.unpack(order + 'H', exif[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 10 > len(exif):
+            break
+        tag, _, _, value = struct.unpack(order + 'HHIH', exif[entry:entry + 10])
+        if tag == 0x0112:
+            return value
+    return 1
+
+def _jpeg_size(data):
+    orientation = 1
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xff:
+            return None
+        marker = data[i + 1]
+        if marker == 0xff:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker == 0xe1 and data[i + 4:i + 10] == b'Exif\0\0':
+            orientation = _exif_orientation(data[i + 10:i + 2 + length])
+        elif 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            # Orientations 5 to 8 turn the image a quarter, so it is shown the other way round
+            return (height, width) if orientation >= 5 else (width, height)
+        i += 2 + length
+    return None
+
+def image_size(data):
+    """Displayed (width, height) of PNG, GIF, JPEG or WebP data, read from its header; None if unknown"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return struct.unpack('<HH', data[6:10])
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X':
+            return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        return None
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_size(data)
+    return None
+
+def image_ref(src):
+    """Path of an image src relative to the docs directory, or None for URLs and paths outside it"""
+    src = unquote(src.split('#', 1)[0].split('?', 1)[0])
+    if not src or ':' in src or src.startswith('/'):
+        return None
+    ref = os.path.normpath(src).replace(os.sep, '/')
+    if ref == '..' or ref.startswith('../'):
+        return None
+    return ref
+
+def _replace_file(path, write):
+    tmp = path.with_name(path.name + '.tmp')
+    write(tmp)
+    os.replace(tmp, path)
+
+def has_image_files(docs_dir):
+    """Whether any file under docs_dir looks like an image, judged by its name alone"""
+    for _, _, files in os.walk(docs_dir):
+        if any(os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES for name in files):
+            return True
+    return False
+
+def process_image(source, sha, image_dir, widths=IMAGE_VARIANT_WIDTHS):
+    """Copy source into image_dir under its content hash, with smaller variants if Pillow is available
+    
+    Returns the record kept for sha: the file name, displayed size (None
+    when the format is not recognised) and [name, width] of each variant.
+    Kept at module level so process pool workers can run it.
+    """
+    source = Path(source)
+    image_dir = Path(image_dir)
+    data = source.read_bytes()
+    suffix = source.suffix.lower()
+    stem = sha[:IMAGE_HASH_LENGTH]
+    name = stem + suffix
+    if not (image_dir / name).exists():
+        _replace_file(image_dir / name, lambda tmp: tmp.write_bytes(data))
+    size = image_size(data)
+    
+    variants = []
+    Image = optional_module('PIL.Image')
+    if Image is not None and size is not None and suffix in IMAGE_VARIANT_SUFFIXES:
+        ImageOps = optional_module('PIL.ImageOps')
+        with Image.open(source) as original:
+            image_format = original.format
+            image = ImageOps.exif_transpose(original)
+            if image.mode == 'P':
+                image = image.convert('RGBA')
+            for width in widths:
+                if width >= size[0]:
+                    break
+                variant = f'{stem}-{width}w{suffix}'
+                if not (image_dir / variant).exists():
+                    resized = image.resize((width, max(1, round(size[1] * width / size[0]))), Image.LANCZOS)
+                    _replace_file(image_dir / variant,
+                                  lambda tmp: resized.save(tmp, format=image_format, quality=82, optimize=True))
+                variants.append([variant, width])
+    return {'name': name, 'size': size, 'variants': variants}
+
+_IMAGE_SRC = re.compile(r'<img src="([^"]*)"')
+
+class ImagePipeline:
+    """Copies the images entries reference into IMAGE_DIR and completes their <img> markup
+    
+    scan() sees each body as the build renders it, through an
+    ImageScanner, and takes the images from the <img> tags the converter
+    produced, so no entry is read just to find them. Each referenced file
+    is hashed and images not seen before are processed on the spot.
+    rewrite() points each <img> at the copy, named by content hash so it
+    can be cached for long, and adds its width and height, so the page
+    reserves the space before the image loads, plus a srcset of the
+    smaller variants. What each file hashed to and what each hash produced
+    is kept in store_file, so unchanged images are not read or touched.
+    Warnings go to report.
+    """
+
+    def __init__(self, docs_dir, output_dir, store_file=None, report=print):
+        self.docs_path = Path(docs_dir)
+        self.image_dir = Path(output_dir) / IMAGE_DIR
+        self.store_file = Path(store_file) if store_file is not None else None
+        self.report = report
+        self.previous = load_json_store(self.store_file, IMAGE_STORE_VERSION)
+        # Records made with and without Pillow differ in their variants
+        if self.previous.get('variants') != has_pillow():
+            self.previous = {}
+        # The page style for images is decided before any body is seen, from the files next to the entries
+        self.present = has_image_files(self.docs_path)
+        self.files = {}
+        self.images = {}
+        # ref -> record of every image found, for rewrite()
+        self.sources = {}
+        self.processed = 0
+
+    def scan(self, html_body):
+        """Find and process the images a rendered body references"""
+        for chunk in body_chunks(html_body):
+            if '<img ' in chunk:
+                for src in _IMAGE_SRC.findall(chunk):
+                    self.add(image_ref(unescape(src)))
+
+    def add(self, ref):
+        if ref is None or ref in self.files:
+            return
+        source = self.docs_path / ref
+        try:
+            stat = source.stat()
+        except OSError:
+            self.report(f"Warning: image {source} not found")
+            self.files[ref] = [None, None, None]
+            return
+        record = self.previous.get('files', {}).get(ref)
+        if record is None or record[:2] != [stat.st_size, stat.st_mtime_ns]:
+            record = [stat.st_size, stat.st_mtime_ns, hashlib.sha256(source.read_bytes()).hexdigest()]
+        self.files[ref] = record
+        sha = record[2]
+        image = self.images.get(sha)
+        if image is None:
+            image = self.previous.get('images', {}).get(sha)
+            if image is None or not all((self.image_dir / name).exists()
+                                        for name in [image['name']] + [name for name, _ in image['variants']]):
+                self.image_dir.mkdir(parents=True, exist_ok=True)
+                image = process_image(source, sha, self.image_dir)
+                self.processed += 1
+            self.images[sha] = image
+        self.sources[ref] = image
+
+    def _replace(self, match, prefix):
+        record = self.sources.get(image_ref(unescape(match.group(1))))
+        if record is None:
+            return match.group(0)
+        url = f'{prefix}{IMAGE_DIR}/{record["name"]}'
+        markup = f'<img src="{url}"'
+        if record['size'] is not None:
+            width, height = record['size']
+            markup += f' width="{width}" height="{height}"'
+            if record['variants']:
+                srcset = [f'{prefix}{IMAGE_DIR}/{name} {w}w' for name, w in record['variants']] + [f'{url} {width}w']
+                shown = f'min({IMAGE_MAX_VW}vw, {IMAGE_MAX_VH * width / height:.0f}vh, {width}px)'
+                markup += f' srcset="{", ".join(srcset)}" sizes="{shown}"'
+        return markup
+
+    def _rewrite(self, text, prefix=''):
+        if '<img ' not in text:
+            return text
+        return _IMAGE_SRC.sub(lambda match: self._replace(match, prefix), text)
+
+    def rewrite(self, html_body, prefix=''):
+        """Point the <img> tags of a body at the processed images; prefix leads to the output directory"""
+        if not self.sources:
+            return html_body
+        if isinstance(html_body, str):
+            return self._rewrite(html_body, prefix)
+        return StreamedBody(html_body.md_file, html_body.fragment, partial(self._rewrite, prefix=prefix))
+
+    def tee(self, entries):
+        """Yield entries with their <img> tags rewritten"""
+        for md_file, html_body in entries:
+            yield md_file, self.rewrite(html_body)
+
+    @property
+    def outputs(self):
+        """Every file in IMAGE_DIR this build uses"""
+        names = set()
+        for record in self.sources.values():
+            names.add(record['name'])
+            names.update(name for name, _ in record['variants'])
+        return [self.image_dir / name for name in sorted(names)]
+
+    @property
+    def inputs(self):
+        """Source path -> [size, mtime_ns] of each referenced image, None for missing ones"""
+        return {str(self.docs_path / ref): record[:2] for ref, record in self.files.items()}
+
+    def finish(self):
+        """Remove images no entry uses any more and save the store; returns (processed, total)"""
+        outputs = self.outputs
+        if self.image_dir.exists():
+            live = {path.name for path in outputs}
+            for stale in self.image_dir.iterdir():
+                if stale.is_file() and stale.name not in live:
+                    stale.unlink()
+        
+        used = {record[2] for record in self.files.values()}
+        save_json_store(self.store_file, {'version': IMAGE_STORE_VERSION, 'variants': has_pillow(),
+                                          'files': self.files,
+                                          'images': {sha: image for sha, image in self.images.items() if sha in used}})
+        return self.processed, len(outputs)
+
+class ImageScanner:
+    """First consumer of a build: shows each body to an ImagePipeline before anything rewrites it"""
+
+    def __init__(self, images):
+        self.images = images
+
+    def tee(self, entries):
+        for md_file, html_body in entries:
+            self.images.scan(html_body)
+            yield md_file, html_body
+
+def snapshot_docs(docs_dir):
+    """Map each markdown file in docs_dir to its (size, mtime_ns) in one scandir pass"""
+    snapshot = {}
+    with os.scandir(docs_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.md') and entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+def snapshot_tree(directory):
+    """Map every file under directory, by its path relative to it, to its (size, mtime_ns)"""
+    snapshot = {}
+    directory = Path(directory)
+    if not directory.is_dir():
+        return snapshot
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = Path(root) / name
+            stat = path.stat()
+            snapshot[path.relative_to(directory).as_posix()] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+ENTRY_INDEX_VERSION = 1
+
+class EntryIndex:
+    """Front matter of every entry, kept in store_file between builds
+    
+    update() reads the header of an entry only when its size or mtime
+    differs from the stored record, so ordering entries, leaving out
+    drafts and building archives cost no file reads on a rebuild.
+    """
+
+    def __init__(self, store_file=None):
+        self.store_file = Path(store_file) if store_file is not None else None
+        self.previous = load_json_store(self.store_file, ENTRY_INDEX_VERSION).get('entries', {})
+        self.entries = {}
+        self.scanned = 0
+
+    def update(self, docs_path, snapshot):
+        """Record the front matter of every entry in a snapshot_docs() result"""
+        for name, (size, mtime_ns) in snapshot.items():
+            record = self.previous.get(name)
+            if record is None or record[:2] != [size, mtime_ns]:
+                record = [size, mtime_ns, read_front_matter(Path(docs_path) / name)]
+                self.scanned += 1
+            self.entries[name] = record
+
+    def metas(self):
+        """Entry stem -> EntryMeta for every recorded entry"""
+        return {Path(name).stem: entry_meta(Path(name).stem, record[2]) for name, record in self.entries.items()}
+
+    def ordered(self, docs_path, metas, drafts=False):
+        """Entry paths oldest first by date, then file name; drafts are left out unless drafts is set"""
+        names = [name for name in self.entries if drafts or not metas[Path(name).stem].draft]
+        names.sort(key=lambda name: (metas[Path(name).stem].date or '', name))
+        return [Path(docs_path) / name for name in names]
+
+    def save(self):
+        save_json_store(self.store_file, {'version': ENTRY_INDEX_VERSION, 'entries': self.entries})
+
+class BuildManifest:
+    """Record of the last build, used to skip a build whose inputs and outputs are unchanged
+    
+    The manifest holds a hash of the build settings, each entry's size,
+    mtime, content hash and cached fragment, the size and mtime of every
+    other input, such as images, and of every file written. A build is
+    skipped only if all of them still match.
+    """
+
+    def __init__(self, manifest_file):
+        self.manifest_file = Path(manifest_file)
+        self.data = load_json_store(self.manifest_file)
+
+    @staticmethod
+    def settings_key(settings):
+        """Hash the build settings together with the converter and templates"""
+        text = json.dumps(settings, sort_keys=True) + renderer_fingerprint()
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def is_current(self, settings, snapshot):
+        """True if the last build used these settings and docs, and its outputs are untouched"""
+        if self.data.get('settings') != self.settings_key(settings):
+            return False
+        entries = self.data.get('entries', {})
+        if entries.keys() != snapshot.keys():
+            return False
+        for name, (size, mtime_ns) in snapshot.items():
+            if entries[name][:2] != [size, mtime_ns]:
+                return False
+        for path, recorded in self.data.get('inputs', {}).items():
+            try:
+                stat = os.stat(path)
+                current = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                current = [None, None]
+            if current != recorded:
+                return False
+        for path, (size, mtime_ns) in self.data.get('outputs', {}).items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                return False
+        return True
+
+    def save(self, settings, snapshot, docs_path, cache, outputs, inputs=None):
+        entries = {}
+        for name, (size, mtime_ns) in snapshot.items():
+            record = cache.seen.get((docs_path / name).as_posix()) if cache is not None else None
+            if record is None:
+                entries[name] = [size, mtime_ns, None, None]
+            else:
+                fragment = fragment_path(cache.fragments_dir, record['sha256'])
+                entries[name] = [size, mtime_ns, record['sha256'], os.path.relpath(fragment, cache.cache_dir)]
+        output_stats = {}
+        for path in outputs:
+            stat = os.stat(path)
+            output_stats[str(path)] = [stat.st_size, stat.st_mtime_ns]
+        
+        self.data = {'settings': self.settings_key(settings), 'entries': entries, 'inputs': inputs or {},
+                     'outputs': output_stats}
+        save_json_store(self.manifest_file, self.data)
+
+def is_core_output(path):
+    """Whether the service worker fetches path on install rather than on first use"""
+    parts = path.split('/')
+    if len(parts) == 1:
+        return path.endswith('.html')
+    return parts[0] == ASSETS_DIR or path in (f'{ENTRY_DIR}/{ENTRY_INDEX_NAME}', f'{SEARCH_DIR}/docs.json')
+
+def write_service_worker(output_dir, outputs, store_file=None, counter_api=DEFAULT_COUNTER_API):
+    """Write SW_NAME with a precache manifest of every output and its content hash
+    
+    Hashes are reused from store_file for outputs whose size and mtime are
+    unchanged, so only rewritten files are read. Returns the path to the
+    service worker and whether it changed.
+    """
+    output_dir = Path(output_dir)
+    previous = load_json_store(store_file)
+    
+    records = {}
+    for path in outputs:
+        name = Path(os.path.relpath(path, output_dir)).as_posix()
+        stat = os.stat(path)
+        record = previous.get(name)
+        if record is None or record[:2] != [stat.st_size, stat.st_mtime_ns]:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(partial(f.read, OUTPUT_BUFFER_SIZE), b''):
+                    digest.update(block)
+            record = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()[:PRECACHE_HASH_LENGTH]]
+        records[name] = record
+    
+    manifest = {quote(name): record[2] for name, record in sorted(records.items())}
+    core = [url for url in manifest if is_core_output(url)]
+    script = SW_SCRIPT.replace('PRECACHE_MANIFEST_PLACEHOLDER', json.dumps(manifest, indent=0, ensure_ascii=False))
+    script = script.replace('PRECACHE_CORE_PLACEHOLDER', json.dumps(core))
+    script = script.replace('COUNTER_API_PLACEHOLDER', counter_api.rstrip('/'))
+    sw_file = output_dir / SW_NAME
+    changed = write_if_changed(sw_file, script)
+    
+    save_json_store(store_file, records)
+    return sw_file, changed
+
+# Where entries are read from and the site is written to; cache_dir None disables caching
+SiteConfig = namedtuple('SiteConfig', 'docs_dir output_file cache_dir templates_dir',
+                        defaults=('docs', 'index.html', DEFAULT_CACHE_DIR, None))
+
+# What to build: jobs None means one worker per CPU, feed is a number of entries or None for no feeds
+BuildOptions = namedtuple('BuildOptions', 'jobs page_size lazy split_assets minify compress entry_pages search '
+                          'service_worker feed force drafts archives',
+                          defaults=(None, None, False, False, False, False, False, False, False, None, False,
+                                    False, False))
+
+class SiteSettings(namedtuple('SiteSettings', 'workspace access_counter like_counter counter_api '
+                              'site_url site_author source_date_epoch',
+                              defaults=('nikkisite2025', 'totalvisits', 'totallikes', DEFAULT_COUNTER_API,
+                                        '', SITE_TITLE, None))):
+    """Counter API and feed settings, the only outside values a build embeds in its output"""
+    __slots__ = ()
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """Read the settings from environment variables (COUNTER_WORKSPACE, SITE_URL, ...)"""
+        environ = os.environ if environ is None else environ
+        defaults = cls()
+        epoch = environ.get('SOURCE_DATE_EPOCH', '')
+        return cls(environ.get('COUNTER_WORKSPACE', defaults.workspace),
+                   environ.get('ACCESS_COUNTER', defaults.access_counter),
+                   environ.get('LIKE_COUNTER', defaults.like_counter),
+                   environ.get('COUNTER_API_URL', defaults.counter_api),
+                   environ.get('SITE_URL', defaults.site_url),
+                   environ.get('SITE_AUTHOR', defaults.site_author),
+                   int(epoch) if epoch.isdigit() else None)
+
+class SiteBuilder:
+    """Builds the site described by a SiteConfig, BuildOptions and SiteSettings
+    
+    Everything a build depends on is passed in: nothing is read from the
+    environment and nothing is kept at module level, so several builders
+    can be used side by side in one process. The progress report goes to
+    stream, standard output by default.
+    """
+
+    def __init__(self, config=None, options=None, settings=None, stream=None):
+        self.config = config if config is not None else SiteConfig()
+        self.options = options if options is not None else BuildOptions()
+        self.settings = settings if settings is not None else SiteSettings()
+        self.stream = stream
+        templates_dir = self.config.templates_dir
+        self.templates = load_templates(templates_dir) if templates_dir else DEFAULT_TEMPLATES
+
+    def _print(self, text):
+        # file=None is whatever sys.stdout is at the time, so redirect_stdout() still works
+        print(text, file=self.stream)
+
+    def render_entry(self, md_file):
+        """Return the HTML body of one entry, reusing the render cache if the config has one"""
+        cache = RenderCache(self.config.cache_dir) if self.config.cache_dir else None
+        return ''.join(body_chunks(render_entry(Path(md_file), cache)))
+
+    def build(self, profiler=None):
+        """Build the site; returns the paths written, or None if there was nothing to build"""
+        docs_dir, output_file, cache_dir = self.config.docs_dir, self.config.output_file, self.config.cache_dir
+        if self.config.templates_dir:
+            # Read again on every build, so edits are picked up when watching
+            self.templates = load_templates(self.config.templates_dir)
+        options, settings, templates = self.options, self.settings, self.templates
+        jobs, page_size, lazy, feed = options.jobs, options.page_size, options.lazy, options.feed
+        minify, compress = options.minify, options.compress
+        entry_pages, search, service_worker = options.entry_pages, options.search, options.service_worker
+        workspace, access_counter, like_counter = settings.workspace, settings.access_counter, settings.like_counter
+        counter_api = settings.counter_api
+        output_dir = Path(output_file).parent
+        docs_path = Path(docs_dir)
+        
+        if not docs_path.exists():
+            self._print(f"Error: {docs_dir} directory not found")
+            return None
+        
+        if profiler is None:
+            profiler = BuildProfiler()
+        profiler.begin()
+        processor = OutputProcessor(minify, compress)
+        
+        # Entries are ordered by their front matter date, read only for files changed since the last build
+        with profiler.phase('scan'):
+            snapshot = snapshot_docs(docs_path)
+            entry_index = EntryIndex(Path(cache_dir) / 'entries.json' if cache_dir else None)
+            entry_index.update(docs_path, snapshot)
+            metas = entry_index.metas()
+            md_files = entry_index.ordered(docs_path, metas, options.drafts)
+        
+        if not md_files:
+            self._print(f"No markdown files found in {docs_dir}")
+            return None
+        output_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Skip the whole build when neither the docs, the settings nor the outputs changed
+        manifest = None
+        build_settings = {'docs_dir': str(docs_dir), 'output_file': str(output_file),
+                          'page_size': page_size, 'lazy': lazy, 'split_assets': options.split_assets,
+                          'minify': minify, 'compress': compress, 'entry_pages': entry_pages, 'search': search,
+                          'service_worker': service_worker, 'drafts': options.drafts, 'archives': options.archives,
+                          'feed': [feed, settings.site_url, settings.site_author, settings.source_date_epoch]
+                          if feed else None,
+                          'counters': [counter_api, workspace, access_counter, like_counter],
+                          'image_variants': has_pillow(), 'templates': templates_fingerprint(templates)}
+        if cache_dir:
+            with profiler.phase('scan'):
+                manifest = BuildManifest(Path(cache_dir) / 'build.json')
+                up_to_date = not options.force and manifest.is_current(build_settings, snapshot)
+            if up_to_date:
+                profiler.end()
+                self._print(f"Nothing changed since the last build of {output_file} (use --force to rebuild)")
+                return None
+        
+        # Reuse rendered bodies from previous builds when caching is enabled
+        with profiler.phase('cache'):
+            cache = RenderCache(cache_dir) if cache_dir else None
+            if cache is not None:
+                cache.prime(docs_path, snapshot)
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        
+        # Images referenced by entries are copied next to the page, sized and downscaled as bodies are rendered
+        with profiler.phase('images'):
+            store_file = Path(cache_dir) / 'images.json' if cache_dir else None
+            images = ImagePipeline(docs_path, output_dir, store_file, self._print)
+        
+        # In lazy mode most bodies go to separate files fetched by the page
+        content_dir = None
+        if lazy:
+            content_dir = output_dir / CONTENT_DIR
+            content_dir.mkdir(parents=True, exist_ok=True)
+        
+        extra_style = PAGER_STYLE if page_size or entry_pages else ''
+        extra_script = LAZY_SCRIPT if lazy else ''
+        if images.present:
+            extra_style += IMAGE_STYLE
+        if search or service_worker:
+            extra_script += SITE_ROOT_SCRIPT
+        if search:
+            extra_style += SEARCH_STYLE
+            extra_script += SEARCH_SCRIPT
+        if service_worker:
+            extra_script += SW_REGISTER_SCRIPT
+        asset_urls = None
+        if options.split_assets:
+            with profiler.phase('write'):
+                style, script = render_assets(workspace, access_counter, like_counter, extra_style, extra_script,
+                                              counter_api, templates)
+                raw_sizes = [len(style.encode('utf-8')), len(script.encode('utf-8'))]
+                asset_urls = write_assets(output_dir, *processor.minify_assets(style, script))
+                for url, raw in zip(asset_urls, raw_sizes):
+                    processor.track(output_dir / url, raw if minify else None)
+        head = render_head(workspace, access_counter, like_counter, extra_style, extra_script, asset_urls,
+                           counter_api, templates, extra_head=feed_links() if feed else '')
+        
+        # Entry and archive pages sit one directory down, so split assets are linked from the parent
+        pages = None
+        if entry_pages or options.archives:
+            entry_asset_urls = tuple('../' + url for url in asset_urls) if asset_urls else None
+            entry_head = head_template(workspace, access_counter, like_counter, extra_style, '', entry_asset_urls,
+                                       counter_api, templates, feed_links('../') if feed else '')
+        if entry_pages:
+            manifest_file = Path(cache_dir) / 'pages.json' if cache_dir else None
+            pages = EntryPages(output_dir, md_files, entry_head, manifest_file, processor, templates, images, metas)
+        
+        # Search results, feed items and archive items link to the entry page when there is one,
+        # else to the page holding the entry
+        if entry_pages:
+            page_for = lambda i, md_file: f'{ENTRY_DIR}/{quote(entry_page_name(md_file.stem))}'
+        elif page_size:
+            page_for = lambda i, md_file: SHARD_NAME.format(shard_number(i, len(md_files), page_size))
+        else:
+            page_for = lambda i, md_file: Path(output_file).name
+        index = None
+        if search:
+            store_file = Path(cache_dir) / 'search.json' if cache_dir else None
+            index = SearchIndex(output_dir, md_files, store_file, processor, page_for, metas)
+        feeds = None
+        if feed:
+            store_file = Path(cache_dir) / 'feed.json' if cache_dir else None
+            feeds = Feeds(output_dir, md_files, feed, store_file, processor, page_for, settings.site_url,
+                          settings.site_url or workspace, settings.site_author, settings.source_date_epoch, metas)
+        # Images are processed as each body first goes by; entry pages and the index then see bodies
+        # before their <img> tags are rewritten, the feeds after
+        consumers = [consumer for consumer in (ImageScanner(images), pages, index, images, feeds)
+                     if consumer is not None]
+        
+        if page_size:
+            shards = write_shards(output_file, head, md_files, page_size, cache, jobs, content_dir, profiler,
+                                  processor, consumers, templates, metas)
+        else:
+            # Reverse the order so 001 is rightmost
+            entries = profiler.iterate('render', iter_rendered_entries(md_files[::-1], cache, jobs, profiler))
+            for consumer in consumers:
+                entries = consumer.tee(entries)
+            with profiler.phase('write'):
+                write_page(output_file, head, entries, '', content_dir, lazy_count_for(len(md_files), content_dir),
+                           processor, templates, metas)
+        
+        if content_dir is not None:
+            with profiler.phase('write'):
+                prune_content_dir(content_dir, md_files)
+        
+        if pages is not None:
+            with profiler.phase('write'):
+                pages_written, pages_total = pages.finish()
+        if index is not None:
+            with profiler.phase('index'):
+                tokenized, index_written = index.finish()
+        if feeds is not None:
+            with profiler.phase('write'):
+                feeds_written = feeds.finish()
+        if options.archives:
+            with profiler.phase('write'):
+                archives = ArchivePages(output_dir, md_files, metas, entry_head, processor, templates, page_for,
+                                        Path(output_file).name, anchors=search and not entry_pages)
+                months, tags = archives.write()
+        
+        with profiler.phase('compress' if compress else 'write'):
+            outputs = processor.finish()
+        with profiler.phase('images'):
+            images_processed, images_total = images.finish()
+        # Images are already compressed, so they bypass the processor
+        output_paths = [path for path, *_ in outputs] + images.outputs
+        
+        if service_worker:
+            with profiler.phase('write'):
+                store_file = Path(cache_dir) / 'precache.json' if cache_dir else None
+                sw_file, sw_changed = write_service_worker(output_dir, output_paths, store_file, counter_api)
+            output_paths.append(sw_file)
+        
+        if cache is not None:
+            with profiler.phase('cache'):
+                cache.save()
+                entry_index.save()
+        if manifest is not None:
+            with profiler.phase('cache'):
+                manifest.save(build_settings, snapshot, docs_path, cache, output_paths, images.inputs)
+        profiler.end()
+        
+        self._print(f"Static site generated: {output_file}")
+        self._print(f"Processed {len(md_files)} markdown files")
+        self._print(f"Rewrote {processor.written} page files whose content changed")
+        if page_size:
+            self._print(f"Split into {shards} pages of up to {page_size} entries")
+        if pages is not None:
+            self._print(f"Entry pages: {pages_written} of {pages_total} written to {ENTRY_DIR}/")
+        if feeds is not None:
+            self._print(f"Feeds: {FEED_ATOM_NAME} and {FEED_JSON_NAME} with {len(feeds.newest)} entries, "
+                        f"{feeds_written} of 2 updated")
+        if options.archives:
+            self._print(f"Archives: {months} months and {tags} tags in {ARCHIVE_DIR}/")
+        if images_total:
+            self._print(f"Images: {images_processed} processed, {images_total} files in {IMAGE_DIR}/")
+        if index is not None:
+            self._print(f"Search index: {tokenized} entries tokenized, "
+                        f"{index_written} files updated in {SEARCH_DIR}/")
+        if service_worker:
+            state = 'updated' if sw_changed else 'unchanged'
+            self._print(f"Service worker: {SW_NAME} {state}, "
+                        f"{len(output_paths) - 1} files in the precache manifest")
+        if cache is not None:
+            self._print(f"Render cache: {cache.hits} hits, {cache.misses} misses")
+            self._print(f"Entry index: {entry_index.scanned} of {len(snapshot)} headers read")
+        if minify or compress:
+            processor.print_report(outputs, output_dir, self.stream)
+        return output_paths
+
+def generate_site(docs_dir='docs', output_file='index.html', cache_dir=DEFAULT_CACHE_DIR, jobs=None,
+                  page_size=None, lazy=False, split_assets=False, minify=False, compress=False,
+                  entry_pages=False, search=False, service_worker=False, templates_dir=None, feed=None,
+                  force=False, profiler=None, drafts=False, archives=False):
+    """Build the site with counter and feed settings from .env and the environment
+    
+    A shortcut for SiteBuilder, which takes the settings explicitly.
+    """
+    load_dotenv_file()
+    config = SiteConfig(docs_dir, output_file, cache_dir, templates_dir)
+    options = BuildOptions(jobs, page_size, lazy, split_assets, minify, compress, entry_pages, search,
+                           service_worker, feed, force, drafts, archives)
+    return SiteBuilder(config, options, SiteSettings.from_env()).build(profiler)
+
+# How often --watch polls the docs directory, in seconds
+WATCH_INTERVAL = 0.5
+RELOAD_PATH = '/__nikki_build'
+
+# Injected into HTML served by --serve; reloads the tab when a rebuild finishes
+RELOAD_SCRIPT = '''<script>
+    (function() {
+        let build = null;
+        setInterval(async () => {
+            try {
+                const response = await fetch('RELOAD_PATH_PLACEHOLDER', { cache: 'no-store' });
+                const current = await response.text();
+                if (build !== null && current !== build) {
+                    location.reload();
+                }
+                build = current;
+            } catch (error) {
+                // サーバー停止中は次の確認を待つ
+            }
+        }, 1000);
+    })();
+</script>
+'''.replace('RELOAD_PATH_PLACEHOLDER', RELOAD_PATH)
+
+def watch_docs(docs_dir, rebuild, interval=WATCH_INTERVAL, templates_dir=None):
+    """Poll docs_dir and call rebuild() after every change, logging how long it took
+    
+    Every file under docs_dir is watched, so images next to the entries
+    count as well as the markdown, and so is templates_dir when given.
+    Images referenced from outside docs_dir are not watched. The standard
+    library has no inotify binding, so this polls; walking the docs
+    directory is cheap next to a rebuild. A rebuild that raises is
+    reported and the loop waits for the next change, so a broken entry or
+    template can be fixed without restarting.
+    """
+    def snapshot():
+        current = snapshot_tree(docs_dir)
+        if templates_dir is not None:
+            current.update({f'{templates_dir}/{name}': record
+                            for name, record in snapshot_tree(templates_dir).items()})
+        return current
+    
+    previous = snapshot()
+    print(f"Watching {docs_dir} for changes (Ctrl+C to stop)")
+    while True:
+        time.sleep(interval)
+        current = snapshot()
+        if current == previous:
+            continue
+        changed = sorted(name for name in current.keys() | previous.keys()
+                         if current.get(name) != previous.get(name))
+        previous = current
+        start = time.perf_counter()
+        try:
+            rebuild()
+        except Exception as error:
+            print(f"Rebuild failed after changes to {', '.join(changed)}: {type(error).__name__}: {error}",
+                  file=sys.stderr)
+            continue
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"Rebuilt in {elapsed:.0f} ms after changes to: {', '.join(changed)}")
+
+@lru_cache(maxsize=None)
+def live_reload_handler():
+    """Return the LiveReloadHandler class; http.server is only imported when serving"""
+    from http.server import SimpleHTTPRequestHandler
+
+    class LiveReloadHandler(SimpleHTTPRequestHandler):
+        """Static file handler that adds the reload script to every HTML page"""
+
+        def do_GET(self):
+            if self.path == RELOAD_PATH:
+                self._send(str(self.server.build_id).encode('utf-8'), 'text/plain; charset=utf-8')
+                return
+            
+            path = Path(self.translate_path(self.path))
+            if path.is_dir():
+                if not self.path.split('?', 1)[0].split('#', 1)[0].endswith('/'):
+                    # Let the base class redirect to the trailing slash, so relative links resolve
+                    super().do_GET()
+                    return
+                path = path / 'index.html'
+            if path.suffix != '.html' or not path.is_file():
+                super().do_GET()
+                return
+            
+            page = path.read_text(encoding='utf-8')
+            page = page.replace('</body>', RELOAD_SCRIPT + '</body>', 1)
+            self._send(page.encode('utf-8'), 'text/html; charset=utf-8')
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # The reload poll would drown out everything else
+            if RELOAD_PATH not in self.requestline:
+                super().log_message(format, *args)
+
+    return LiveReloadHandler
+
+def serve_site(directory, port):
+    """Serve directory over HTTP in a background thread; returns the server"""
+    from http.server import ThreadingHTTPServer
+    handler = partial(live_reload_handler(), directory=str(directory))
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.build_id = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {directory} at http://127.0.0.1:{port}/")
+    return server
+
+def parse_args(argv=None):
+    import argparse
+    
+    def positive_int(value):
+        number = int(value)
+        if number < 1:
+            raise argparse.ArgumentTypeError(f'must be at least 1: {value}')
+        return number
+    
+    parser = argparse.ArgumentParser(description='Generate the Nikki static site from markdown entries')
+    parser.add_argument('--docs', default='docs', metavar='DIR',
+                        help='directory holding the markdown entries (default: docs)')
+    parser.add_argument('-o', '--output', default='index.html', metavar='FILE',
+                        help='page to write; every other output goes next to it (default: index.html)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, metavar='DIR',
+                        help=f'render cache and build records (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='convert every entry and keep no build records')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes for converting entries (default: CPU count)')
+    parser.add_argument('--page-size', type=positive_int, default=None, metavar='N',
+                        help='split the site into pages of N entries (default: one page)')
+    parser.add_argument('--lazy', action='store_true',
+                        help='load entry bodies from content/ as they scroll into view')
+    parser.add_argument('--watch', action='store_true',
+                        help='rebuild whenever an entry in the docs directory changes')
+    parser.add_argument('--serve', action='store_true',
+                        help='serve the site locally with auto-reload (implies --watch)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port for --serve (default: 8000)')
+    parser.add_argument('--profile', action='store_true',
+                        help='print per-phase timings and the slowest entries to stderr')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help='write the build profile to FILE as JSON')
+    parser.add_argument('--profile-pstats', metavar='FILE',
+                        help='run the build under cProfile and dump the stats to FILE')
+    parser.add_argument('--profile-top', type=int, default=10, metavar='N',
+                        help='number of slowest entries to report (default: 10)')
+    parser.add_argument('--split-assets', action='store_true',
+                        help='write CSS and JS to content-hashed files under assets/')
+    parser.add_argument('--minify', action='store_true',
+                        help='strip indentation, blank lines and comments from HTML, CSS and JS')
+    parser.add_argument('--compress', action='store_true',
+                        help='also write .gz (and .br with the brotli module) copies of every output')
+    parser.add_argument('--entry-pages', action='store_true',
+                        help='also write one page per entry and a title index under entries/')
+    parser.add_argument('--search', action='store_true',
+                        help='build a bigram search index under search/ and add a search box')
+    parser.add_argument('--service-worker', action='store_true',
+                        help='write sw.js, which caches the site for offline and repeat visits')
+    parser.add_argument('--feed', type=positive_int, nargs='?', const=FEED_ENTRIES, default=None, metavar='N',
+                        help=f'also write Atom and JSON feeds of the newest N entries (default: {FEED_ENTRIES})')
+    parser.add_argument('--drafts', action='store_true',
+                        help='include entries marked draft: true in their front matter')
+    parser.add_argument('--archives', action='store_true',
+                        help='also write month and tag archive pages under archive/')
+    parser.add_argument('--templates', metavar='DIR',
+                        help='read page templates from DIR; files missing there use the built-in ones')
+    parser.add_argument('--dump-templates', metavar='DIR',
+                        help='write the built-in templates to DIR to start customizing, then exit')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild even if nothing changed since the last build')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.dump_templates:
+        write_default_templates(args.dump_templates)
+        print(f"Wrote the built-in templates to {args.dump_templates}")
+        return
+    
+    # Only the command line reads .env; SiteBuilder itself takes its settings as arguments
+    load_dotenv_file()
+    config = SiteConfig(args.docs, args.output, None if args.no_cache else args.cache_dir, args.templates)
+    options = BuildOptions(args.jobs, args.page_size, args.lazy, args.split_assets, args.minify, args.compress,
+                           args.entry_pages, args.search, args.service_worker, args.feed, args.force,
+                           args.drafts, args.archives)
+    try:
+        builder = SiteBuilder(config, options, SiteSettings.from_env())
+    except TemplateError as error:
+        sys.exit(f"Error: {error}")
+    
+    def build():
+        profiler = BuildProfiler()
+        stats = None
+        if args.profile_pstats:
+            import cProfile
+            stats = cProfile.Profile()
+            stats.enable()
+        builder.build(profiler)
+        if stats is not None:
+            stats.disable()
+            stats.dump_stats(args.profile_pstats)
+        if args.profile:
+            profiler.print_report(args.profile_top)
+        if args.profile_json:
+            with open(args.profile_json, 'w', encoding='utf-8') as f:
+                json.dump(profiler.report(args.profile_top), f, indent=2)
+    
+    try:
+        build()
+    except TemplateError as error:
+        sys.exit(f"Error: {error}")
+    if args.watch or args.serve:
+        server = serve_site(Path(args.output).parent.resolve(), args.port) if args.serve else None
+        
+        def rebuild():
+            build()
+            if server is not None:
+                server.build_id += 1
+        
+        try:
+            watch_docs(args.docs, rebuild, templates_dir=args.templates)
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
-    generate_site()
\ No newline at end of file
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Micro-benchmark the markdown converter on a large synthetic corpus
+
+Reports the per-entry cost of markdown_to_html() with the precompiled
+rule tables, next to the original chained re.sub converter kept in
+markdown_regression.py:
+
+    python3 tools/bench_markdown.py --entries 20000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark import DEFAULT_MIX, generate_entry, parse_mix
+from generate_site import markdown_to_html
+from markdown_regression import legacy_markdown_to_html
+
+CONVERTERS = {
+    'markdown_to_html': markdown_to_html,
+    'legacy': legacy_markdown_to_html,
+}
+
+def measure(convert, corpus, repeat):
+    """Best-of-repeat seconds to convert the whole corpus once"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            convert(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-entry cost of the markdown converter')
+    parser.add_argument('--entries', type=int, default=5000, help='number of entries (default: 5000)')
+    parser.add_argument('--size', type=int, default=1500, help='mean characters per entry (default: 1500)')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX), help='block weights, as in benchmark.py')
+    parser.add_argument('--emphasis', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per converter, best is kept (default: 3)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [generate_entry(rng, max(1, int(rng.gauss(args.size, args.size / 3))), args.mix, args.emphasis)
+              for _ in range(args.entries)]
+
+    results = {}
+    for name, convert in CONVERTERS.items():
+        seconds = measure(convert, corpus, args.repeat)
+        results[name] = {'total': seconds, 'per_entry_us': seconds / len(corpus) * 1e6}
+
+    if args.json:
+        print(json.dumps({'entries': len(corpus), 'chars': sum(map(len, corpus)), 'results': results}, indent=2))
+        return
+    print(f"{len(corpus)} entries, {sum(map(len, corpus))} characters")
+    for name, result in results.items():
+        print(f"  {name:<18}{result['per_entry_us']:9.1f} us/entry{result['total']:9.3f} s total")
+
+if __name__ == "__main__":
+    main()
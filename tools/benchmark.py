@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Benchmark the site builder on a synthetic Japanese diary corpus
+
+Generates a corpus of configurable size and feature mix, then times:
+
+    build_cold   generate_site() with an empty render cache
+    build_warm   generate_site(force=True) again, every entry a cache hit
+    build_noop   generate_site() once more, skipped as nothing changed
+    read         reading the markdown files
+    parse        tokenize_markdown() over every entry
+    render       render_markdown_tokens() over every entry
+    write        streaming the page with write_page()
+
+Results, including peak RSS, are printed as JSON so runs on different
+commits can be compared:
+
+    python3 tools/benchmark.py --entries 5000 --output bench.json
+    python3 tools/benchmark.py --mix paragraph=1,code=3 --write-corpus /tmp/corpus
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from generate_site import (generate_site, render_head, render_markdown_tokens,
+                           tokenize_markdown, write_page)
+
+WORDS = [
+    '今日', '昨日', '明日', '朝', '夜', '夏休み', '言葉', '犬', '友人', '散歩', '空', '雨',
+    '図書館', 'パスタ', '概念', '世界', '心', '短歌', '数字', '電車', '窓', '光', '影',
+    'ゆっくり', 'ふわっと', '少し', 'ずっと', 'たぶん', 'なんとなく', 'すごく',
+    'を見た', 'について考えた', 'が好きだ', 'を書いた', 'に気がついた', 'を思い出した',
+    'のことを話した', 'が不思議だった', 'を歩いた', 'が聞こえた',
+]
+CODE_LINES = ['def main():', '    return 0', 'x = [i * i for i in range(10)]',
+              'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAABAAAAAQ', 'print("こんにちは")']
+
+# Relative weight of each block kind in an entry
+DEFAULT_MIX = {
+    'paragraph': 6,
+    'long_paragraph': 1,
+    'list': 2,
+    'nested_list': 1,
+    'code': 1,
+    'quote': 1,
+    'heading': 1,
+}
+
+def sentence(rng, emphasis):
+    words = ''.join(rng.choice(WORDS) for _ in range(rng.randint(3, 8)))
+    roll = rng.random()
+    if roll < emphasis / 3:
+        words = f'**{words}**'
+    elif roll < emphasis * 2 / 3:
+        words = f'*{words}*'
+    elif roll < emphasis:
+        words = f'{words}`{rng.choice(WORDS)}`'
+    return words + '。'
+
+def block(rng, kind, emphasis):
+    if kind == 'paragraph':
+        return '\n'.join(sentence(rng, emphasis) for _ in range(rng.randint(1, 4)))
+    if kind == 'long_paragraph':
+        return '\n'.join(sentence(rng, emphasis) for _ in range(rng.randint(20, 60)))
+    if kind == 'list':
+        return '\n'.join(f'- {sentence(rng, emphasis)}' for _ in range(rng.randint(2, 8)))
+    if kind == 'nested_list':
+        lines = []
+        for n in range(rng.randint(2, 6)):
+            lines.append(f'{n + 1}. {sentence(rng, emphasis)}')
+            lines.extend(f'    - {sentence(rng, emphasis)}' for _ in range(rng.randint(0, 3)))
+        return '\n'.join(lines)
+    if kind == 'code':
+        lang = rng.choice(['', 'python', 'text'])
+        body = '\n'.join(rng.choice(CODE_LINES) for _ in range(rng.randint(1, 12)))
+        return f'```{lang}\n{body}\n```'
+    if kind == 'quote':
+        return '\n'.join(f'> {sentence(rng, emphasis)}' for _ in range(rng.randint(1, 3)))
+    return f'{"#" * rng.randint(1, 3)} {rng.choice(WORDS)}{rng.choice(WORDS)}'
+
+def generate_entry(rng, size, mix, emphasis):
+    """Return one entry of roughly size characters drawn from the block mix"""
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    blocks = []
+    length = 0
+    while length < size:
+        text = block(rng, rng.choices(kinds, weights)[0], emphasis)
+        blocks.append(text)
+        length += len(text)
+    return '\n\n'.join(blocks)
+
+def write_corpus(directory, entries, size, mix, emphasis, seed):
+    """Write a synthetic corpus of date-named entries; returns the total bytes"""
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for n in range(entries):
+        text = generate_entry(rng, max(1, int(rng.gauss(size, size / 3))), mix, emphasis)
+        path = directory / f'{20000101 + n:08d}.md'
+        path.write_text(text, encoding='utf-8')
+        total += path.stat().st_size
+    return total
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    for item in value.split(','):
+        if item:
+            kind, _, weight = item.partition('=')
+            if kind not in DEFAULT_MIX:
+                raise argparse.ArgumentTypeError(f'unknown block kind: {kind}')
+            mix[kind] = float(weight)
+    return mix
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    # generate_site() reports progress on stdout, which would corrupt the JSON
+    with redirect_stdout(StringIO()):
+        func(*args, **kwargs)
+    return time.perf_counter() - start
+
+def run(docs_dir, work_dir, jobs):
+    results = {}
+    output = work_dir / 'index.html'
+    cache_dir = work_dir / 'cache'
+    results['build_cold'] = timed(generate_site, docs_dir, output, cache_dir, jobs)
+    # Without force the unchanged build manifest would skip the build altogether
+    results['build_warm'] = timed(generate_site, docs_dir, output, cache_dir, jobs, force=True)
+    results['build_noop'] = timed(generate_site, docs_dir, output, cache_dir, jobs)
+    results['peak_rss_kb_build'] = peak_rss_kb()
+
+    md_files = sorted(Path(docs_dir).glob('*.md'))
+    read = parse = render = 0.0
+    bodies = []
+    for md_file in md_files:
+        start = time.perf_counter()
+        text = md_file.read_text(encoding='utf-8')
+        after_read = time.perf_counter()
+        tokens = list(tokenize_markdown(text.split('\n')))
+        after_parse = time.perf_counter()
+        bodies.append('\n'.join(render_markdown_tokens(tokens)))
+        after_render = time.perf_counter()
+        read += after_read - start
+        parse += after_parse - after_read
+        render += after_render - after_parse
+    results['read'] = read
+    results['parse'] = parse
+    results['render'] = render
+
+    head = render_head('bench', 'visits', 'likes')
+    start = time.perf_counter()
+    write_page(work_dir / 'phases.html', head, zip(md_files[::-1], bodies[::-1]))
+    results['write'] = time.perf_counter() - start
+    results['peak_rss_kb'] = peak_rss_kb()
+    results['output_bytes'] = output.stat().st_size
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Nikki site builder')
+    parser.add_argument('--entries', type=int, default=1000, help='number of entries (default: 1000)')
+    parser.add_argument('--size', type=int, default=1500, help='mean characters per entry (default: 1500)')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='block weights, e.g. paragraph=4,code=2 (kinds: %s)' % ', '.join(DEFAULT_MIX))
+    parser.add_argument('--emphasis', type=float, default=0.2,
+                        help='share of sentences with bold, italic or code (default: 0.2)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='jobs for the build phases (default: 1)')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--write-corpus', metavar='DIR', help='only generate the corpus into DIR')
+    args = parser.parse_args()
+
+    if args.write_corpus:
+        total = write_corpus(args.write_corpus, args.entries, args.size, args.mix, args.emphasis, args.seed)
+        print(f"Wrote {args.entries} entries ({total} bytes) to {args.write_corpus}")
+        return
+
+    with tempfile.TemporaryDirectory(prefix='nikki-bench-') as tmp:
+        work_dir = Path(tmp)
+        docs_dir = work_dir / 'docs'
+        total = write_corpus(docs_dir, args.entries, args.size, args.mix, args.emphasis, args.seed)
+        results = run(docs_dir, work_dir, args.jobs)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'corpus': {'entries': args.entries, 'size': args.size, 'mix': args.mix,
+                   'emphasis': args.emphasis, 'seed': args.seed, 'bytes': total},
+        'jobs': args.jobs,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+    print(text)
+
+if __name__ == "__main__":
+    main()
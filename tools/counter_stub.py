@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Counter API V2 used by the generated page
+
+Answers the two endpoints the page calls, with counts kept in memory:
+
+    GET /v2/<workspace>/<counter>      current value
+    GET /v2/<workspace>/<counter>/up   increment, then return the value
+
+Every request is logged with a running total, so the number of round
+trips a page load or a burst of like clicks costs is easy to read off:
+
+    python3 tools/counter_stub.py --port 8787 --latency 0.3
+    COUNTER_API_URL=http://localhost:8787/v2 python3 generate_site.py --serve
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class CounterStubHandler(BaseHTTPRequestHandler):
+    """Serves counts from server.counts, a dict of (workspace, counter) -> value"""
+
+    def do_GET(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        up = parts[-1] == 'up'
+        if up:
+            parts = parts[:-1]
+        if len(parts) != 3 or parts[0] != 'v2':
+            self.send_json(404, {'message': 'not found'})
+            return
+
+        time.sleep(self.server.latency)
+        key = (parts[1], parts[2])
+        with self.server.lock:
+            if up:
+                self.server.counts[key] = self.server.counts.get(key, 0) + 1
+            count = self.server.counts.get(key, 0)
+            self.server.requests += 1
+            total = self.server.requests
+        print(f"#{total} {'up  ' if up else 'read'} {key[0]}/{key[1]} = {count}", flush=True)
+        self.send_json(200, {'data': {'up_count': count}})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        # The page is served from another origin
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # do_GET prints its own, shorter log line
+        pass
+
+def make_server(port, latency=0.0):
+    server = ThreadingHTTPServer(('', port), CounterStubHandler)
+    server.counts = {}
+    server.lock = threading.Lock()
+    server.latency = latency
+    server.requests = 0
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Counter API V2')
+    parser.add_argument('--port', type=int, default=8787, help='port to listen on (default: 8787)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency)
+    print(f"Counter API stub on http://localhost:{args.port}/v2 (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Compare the single-pass markdown engine against the original converter
+
+Every case in CORPUS must render byte-identically with both engines.
+DIVERGENCES pins the inputs where the original output was wrong, together
+with the output the new engine is expected to produce instead. Real
+entries are compared against the original converter, except for lines
+that differ only by a pinned divergence (see pinned_line()).
+
+    python3 tools/markdown_regression.py            # check the corpus
+    python3 tools/markdown_regression.py docs/*.md  # also compare real entries
+"""
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from generate_site import markdown_to_html
+
+def legacy_markdown_to_html(text):
+    """The original chained re.sub converter, frozen as the reference output"""
+    html = text
+    
+    # Convert headers
+    html = re.sub(r'^### (.+)$', r'<h3>\1</h3>', html, flags=re.MULTILINE)
+    html = re.sub(r'^## (.+)$', r'<h3>\1</h3>', html, flags=re.MULTILINE)
+    html = re.sub(r'^# (.+)$', r'<h3>\1</h3>', html, flags=re.MULTILINE)
+    
+    # Convert bold
+    html = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html)
+    html = re.sub(r'__(.+?)__', r'<strong>\1</strong>', html)
+    
+    # Convert italic
+    html = re.sub(r'\*(.+?)\*', r'<em>\1</em>', html)
+    html = re.sub(r'_(.+?)_', r'<em>\1</em>', html)
+    
+    # Convert code blocks
+    html = re.sub(r'```[\w]*\n(.*?)\n```', r'<pre><code>\1</code></pre>', html, flags=re.DOTALL)
+    
+    # Convert inline code
+    html = re.sub(r'`(.+?)`', r'<code>\1</code>', html)
+    
+    # Convert blockquotes
+    html = re.sub(r'^> (.+)$', r'<blockquote>\1</blockquote>', html, flags=re.MULTILINE)
+    
+    # Convert lists
+    html = re.sub(r'^- (.+)$', r'<li>\1</li>', html, flags=re.MULTILINE)
+    html = re.sub(r'^[0-9]+\. (.+)$', r'<li>\1</li>', html, flags=re.MULTILINE)
+    
+    # Wrap consecutive list items in ul tags
+    html = re.sub(r'(<li>.*?</li>\n?)+', lambda m: '<ul>\n' + m.group(0) + '</ul>\n', html, flags=re.DOTALL)
+    
+    # Convert paragraphs - handle single line breaks properly for Japanese text
+    paragraphs = []
+    current_para = []
+    in_pre = False
+    in_list = False
+    
+    for line in html.split('\n'):
+        if '<pre>' in line:
+            in_pre = True
+        if '</pre>' in line:
+            in_pre = False
+        if '<ul>' in line:
+            in_list = True
+        if '</ul>' in line:
+            in_list = False
+            
+        if line.strip() == '' and not in_pre and not in_list:
+            if current_para:
+                # Join lines without spaces for Japanese text
+                paragraphs.append('<p>' + ''.join(current_para) + '</p>')
+                current_para = []
+        elif not line.startswith('<') or in_pre:
+            if not in_pre and not in_list:
+                current_para.append(line.strip())
+            else:
+                paragraphs.append(line)
+        else:
+            if current_para:
+                # Join lines without spaces for Japanese text
+                paragraphs.append('<p>' + ''.join(current_para) + '</p>')
+                current_para = []
+            paragraphs.append(line)
+    
+    if current_para:
+        # Join lines without spaces for Japanese text
+        paragraphs.append('<p>' + ''.join(current_para) + '</p>')
+    
+    return '\n'.join(paragraphs)
+
+
+CORPUS = [
+    ('empty', ''),
+    ('single line', 'こんにちは'),
+    ('paragraph lines join without spaces', '一行目\n二行目  \n  三行目'),
+    ('paragraphs split on blank lines', '一つ目\n\n二つ目\n\n\n三つ目\n'),
+    ('whitespace-only line splits', '一つ目\n   \n二つ目'),
+    ('headings', '# 大見出し\n## 中見出し\n### 小見出し\n#### 四つは見出しではない'),
+    ('heading without text', '# \n### '),
+    ('heading keeps extra spaces', '###  余白'),
+    ('heading inside paragraph', '前の段落\n# 見出し\n後の段落'),
+    ('bold', '文中の**太字**と__太字__'),
+    ('italic', '文中の*斜体*と_斜体_'),
+    ('bold inside italic', 'これは*斜体の中の**太字**です*'),
+    ('italic inside bold', 'これは**太字の中の*斜体*です**'),
+    ('inline code', '行の途中に`コード`を含む'),
+    ('inline code mid-line', '文中の`コード`と**太字**'),
+    ('emphasis in headings', '## **強調**された*見出し*'),
+    ('blockquote', '> 引用文\n> 二行目の引用'),
+    ('blockquote between paragraphs', '地の文\n> 引用\n地の文'),
+    ('bare quote marker', '>引用ではない\n> '),
+    ('unordered list', '- りんご\n- みかん\n- ぶどう\n'),
+    ('ordered list', '1. 一つ目\n2. 二つ目\n10. 十個目\n'),
+    ('mixed list markers', '- 点\n1. 番号\n- 点\n'),
+    ('list after paragraph', '買うもの\n- 卵\n- 牛乳\n\nおわり'),
+    ('paragraph after list', '- 卵\n- 牛乳\nおわり'),
+    ('lists split by blank line', '- 一\n\n- 二\n'),
+    ('list at end without newline', '本文\n\n- 最後の項目\n- もう一つ'),
+    ('list items with emphasis', '- **太字**の項目\n- *斜体*の項目\n'),
+    ('list marker needs a space', '-ハイフン\n1.番号'),
+    ('single-line code block', '前\n```\ndata:image/png;base64,iVBORw0KGgo\n```\n\n後'),
+    ('single-line code block with language', '```python\nprint(1)\n```'),
+    ('raw html line', '<div class="photo">写真</div>\n本文'),
+    ('raw html between paragraphs', '本文\n<hr>\n本文'),
+    ('indented html is text', '  <span>字下げ</span>'),
+    ('raw pre block', '<pre>\n一行目\n\n  三行目\n</pre>\n本文'),
+    ('inline markup after ruby', '<ruby>漢<rt>かん</rt></ruby>の**字**'),
+    ('inline markup inside span', '<span>**太字**</span>'),
+    ('inline markup after br', '<br>**強調**\n本文'),
+    ('trailing spaces', 'どこかに行ければいいなと思う。  '),
+    ('sample entry', '私の大好きな友人に、数学のできるZがいる。\nある日、Zがものを説明しながら空中に何か置く動作をした。\n\n'
+                     'もう一つ、私が短歌をやっていたころの話だ。\n\n犬は数字に名前がついてることは知らない。'),
+]
+
+# (name, markdown, new output) for inputs the original converter got wrong
+DIVERGENCES = [
+    # Lines starting with inline markup were taken for raw HTML and never wrapped in <p>
+    ('line starting with inline code', '`君は君の概念に気がついているが`',
+     '<p><code>君は君の概念に気がついているが</code></p>'),
+    ('line starting with bold', '**大事**なこと\n続き',
+     '<p><strong>大事</strong>なこと続き</p>'),
+    # The closing line of a multi-line code block was folded into a paragraph
+    ('multi-line code block', '```\na = 1\nb = 2\n```',
+     '<pre><code>a = 1\nb = 2</code></pre>'),
+    # Markup inside code used to be converted
+    ('emphasis inside code span', '`a*b*c`', '<p><code>a*b*c</code></p>'),
+    ('markdown inside code block', '```\n# not a heading\n- not a list\n**x**\n```',
+     '<pre><code># not a heading\n- not a list\n**x**</code></pre>'),
+    # An unclosed fence now runs to the end of the entry
+    ('unclosed code fence', '```\ncode', '<pre><code>code</code></pre>'),
+    # So does an unclosed raw <pre> or <ul>, whose lines are passed through unconverted;
+    # the original converted markdown inside them and never closed the tag either
+    ('unclosed raw pre', '<pre>\n一行目\n\n**太字**\n# 見出し', '<pre>\n一行目\n\n**太字**\n# 見出し'),
+    ('unclosed raw list', '<ul>\n<li>項目</li>\n\n本文\n- 点', '<ul>\n<li>項目</li>\n\n本文\n- 点'),
+]
+
+# Inline tags a line may start with and still be a paragraph; the original took such lines for raw HTML
+INLINE_START = ('<code>', '<strong>', '<em>')
+
+def pinned_line(expected, got):
+    """Whether one differing output line is the pinned 'line starting with inline markup' case"""
+    return expected.startswith(INLINE_START) and got == f'<p>{expected}</p>'
+
+def compare(name, text, expected=None, pinned=False):
+    """Return a failure message for one input, or None when it renders as expected
+    
+    With pinned set, lines explained by pinned_line() are not counted as
+    differences.
+    """
+    new = markdown_to_html(text)
+    if expected is None:
+        expected = legacy_markdown_to_html(text)
+    if new == expected:
+        return None
+    if pinned:
+        expected_lines, new_lines = expected.split('\n'), new.split('\n')
+        if len(expected_lines) == len(new_lines) and all(
+                a == b or pinned_line(a, b) for a, b in zip(expected_lines, new_lines)):
+            return None
+    return f'{name}:\n  expected: {expected!r}\n  got:      {new!r}'
+
+def main(paths):
+    failures = []
+    for name, text in CORPUS:
+        failures.append(compare(name, text))
+    for name, text, expected in DIVERGENCES:
+        failures.append(compare(name, text, expected))
+    for path in paths:
+        failures.append(compare(path, Path(path).read_text(encoding='utf-8'), pinned=True))
+    
+    failures = [failure for failure in failures if failure]
+    for failure in failures:
+        print(failure)
+    total = len(CORPUS) + len(DIVERGENCES) + len(paths)
+    print(f"{total - len(failures)}/{total} cases match")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))